@@ -0,0 +1,102 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.shortcuts import redirect
+from django.utils.cache import patch_cache_control
+from rest_framework.authentication import get_authorization_header
+from rest_framework.renderers import JSONRenderer
+
+from .authentication import CachedTokenAuthentication
+from .cache import short_link_cache, token_cache
+from .ingredient_index import ingredient_index
+from .views import (IngredientViewSet, ShortLinkViewSet,
+                    get_ingredient_search_limit)
+
+
+def in_thread(view):
+    """Синхронное представление DRF для вызова из асинхронного.
+
+    Django 3.2 выполнил бы такое представление и рендеринг ответа
+    в двух разных заходах в поток sync_to_async, здесь всё делается
+    за один, а наружу отдаётся уже готовый HttpResponse.
+    """
+
+    def call(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if not hasattr(response, 'render'):
+            return response
+        response.render()
+        rendered = HttpResponse(
+            response.content, status=response.status_code
+        )
+        for header, value in response.items():
+            rendered[header] = value
+        rendered.cookies = response.cookies
+        return rendered
+
+    return sync_to_async(call)
+
+
+def async_view(view):
+    # csrf_exempt из Django 3.2 не умеет оборачивать корутины,
+    # а CSRF для сессий проверяет сам DRF.
+    view.csrf_exempt = True
+    return view
+
+
+sync_short_link = in_thread(ShortLinkViewSet.as_view())
+sync_ingredient_list = in_thread(IngredientViewSet.as_view({'get': 'list'}))
+
+
+def is_known_token(request):
+    """Проверяет токен запроса по кешу процесса, не обращаясь к базе.
+
+    Как и CachedTokenAuthentication, запрос без заголовка Token
+    считается анонимным. False — токен здесь не проверить: его нет
+    в кеше или заголовок неверный. Тогда запрос уходит
+    в синхронное представление, и оно при необходимости отвечает 401.
+    """
+    auth = get_authorization_header(request).split()
+    keyword = CachedTokenAuthentication.keyword.lower().encode()
+    if not auth or auth[0].lower() != keyword:
+        return True
+    if len(auth) != 2:
+        return False
+    try:
+        token = token_cache.get(auth[1].decode())
+    except UnicodeError:
+        return False
+    return token is not None and token.user.is_active
+
+
+@async_view
+async def short_link(request, short_code):
+    """Переход по короткой ссылке, известной процессу, без потоков."""
+    recipe_id = short_link_cache.get(short_code)
+    if recipe_id is None:
+        return await sync_short_link(request, short_code=short_code)
+    response = redirect(request.build_absolute_uri(f'/recipes/{recipe_id}/'))
+    patch_cache_control(
+        response, public=True, max_age=settings.SHORT_LINK_CACHE_TTL
+    )
+    return response
+
+
+@async_view
+async def ingredient_list(request):
+    """Поиск ингредиентов по загруженному индексу прямо в цикле событий.
+
+    Всё остальное — холодный индекс, полный список, другие форматы,
+    токен, которого нет в кеше, — уходит в IngredientViewSet.
+    """
+    name = request.GET.get('name')
+    snapshot = ingredient_index.peek()
+    if (request.method != 'GET' or not name or snapshot is None
+            or 'format' in request.GET or not is_known_token(request)):
+        return await sync_ingredient_list(request)
+    return HttpResponse(
+        JSONRenderer().render(ingredient_index.search(
+            name, get_ingredient_search_limit(request.GET), snapshot
+        )),
+        content_type='application/json'
+    )
@@ -0,0 +1,34 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import SAFE_METHODS
+
+from .cache import get_token
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса к базе на каждый вызов API.
+
+    Для безопасных методов токен вместе с пользователем берётся
+    из api.cache.get_token. Кеш сбрасывается сигналами при удалении
+    токена (выход через djoser) и при сохранении пользователя (смена
+    пароля, блокировка), а в других процессах без общего кеша
+    устаревает за TOKEN_CACHE_TTL. Изменяющие запросы всегда читают
+    токен и пользователя из базы: запись не должна идти от имени
+    вышедшего или заблокированного пользователя и сохранять его
+    устаревший снимок.
+    """
+
+    use_cache = True
+
+    def authenticate(self, request):
+        self.use_cache = request.method in SAFE_METHODS
+        return super().authenticate(request)
+
+    def authenticate_credentials(self, key):
+        token = get_token(key, cached=self.use_cache)
+        if token is None:
+            raise AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        return token.user, token
@@ -0,0 +1,234 @@
+import copy
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from recipes.models import Recipe
+from rest_framework.authtoken.models import Token
+
+SHOPPING_CART_VERSION_KEY = 'shopping_cart_version:{}'
+SHOPPING_LIST_KEY = 'shopping_list:{}:{}'
+SHORT_LINK_KEY = 'short_link:{}'
+FEED_VERSION_KEY = 'feed_version:{}'
+FEED_HEAD_KEY = 'feed_head:{}:{}:{}'
+REFERENCE_VERSION_KEY = 'reference_version:{}'
+TOKEN_KEY = 'auth_token:{}'
+PRIMARY_PIN_KEY = 'primary_pin:{}'
+
+
+class LRUCache:
+    """Потокобезопасный LRU-кеш в памяти процесса с необязательным TTL."""
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                return default
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+short_link_cache = LRUCache(
+    settings.SHORT_LINK_CACHE_SIZE, settings.SHORT_LINK_CACHE_TTL
+)
+
+token_cache = LRUCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+
+
+def _shared_short_link_cache():
+    alias = settings.SHORT_LINK_SHARED_CACHE
+    return caches[alias] if alias else None
+
+
+def _get_version(key):
+    """Версия закешированных данных, меняется при каждом их изменении.
+
+    Вместо счётчика используется случайная строка: если ключ будет
+    вытеснен из кеша, новая версия не совпадёт ни с одной из старых.
+    """
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def _bump_versions(key_template, ids):
+    cache.set_many(
+        {key_template.format(pk): uuid.uuid4().hex for pk in ids},
+        None
+    )
+
+
+def get_shopping_cart_version(user_id):
+    return _get_version(SHOPPING_CART_VERSION_KEY.format(user_id))
+
+
+def bump_shopping_cart_version(*user_ids):
+    _bump_versions(SHOPPING_CART_VERSION_KEY, user_ids)
+
+
+def get_shopping_list(user_id, version):
+    return cache.get(SHOPPING_LIST_KEY.format(user_id, version))
+
+
+def cache_shopping_list(user_id, version, ingredients):
+    """Отдаёт строки списка дальше и кладёт его в кеш, когда он дочитан."""
+    shopping_list = []
+    for ingredient in ingredients:
+        shopping_list.append(ingredient)
+        yield ingredient
+    cache.set(
+        SHOPPING_LIST_KEY.format(user_id, version),
+        shopping_list,
+        settings.SHOPPING_LIST_CACHE_TIMEOUT
+    )
+
+
+def get_feed_version(user_id):
+    return _get_version(FEED_VERSION_KEY.format(user_id))
+
+
+def bump_feed_version(*user_ids):
+    """Сбрасывает закешированное начало ленты у этих пользователей."""
+    _bump_versions(FEED_VERSION_KEY, user_ids)
+
+
+def get_feed_head(user_id, version, page_size):
+    return cache.get(FEED_HEAD_KEY.format(user_id, version, page_size))
+
+
+def set_feed_head(user_id, version, page_size, recipe_ids):
+    cache.set(
+        FEED_HEAD_KEY.format(user_id, version, page_size),
+        recipe_ids,
+        settings.FEED_CACHE_TIMEOUT
+    )
+
+
+def get_reference_version(name):
+    return _get_version(REFERENCE_VERSION_KEY.format(name))
+
+
+def bump_reference_version(*names):
+    """Заставляет все процессы пересобрать готовые ответы справочников."""
+    _bump_versions(REFERENCE_VERSION_KEY, names)
+
+
+def resolve_short_link(short_code):
+    """id рецепта по короткому коду: память процесса, общий кеш, база."""
+    recipe_id = short_link_cache.get(short_code)
+    if recipe_id is not None:
+        return recipe_id
+    shared_cache = _shared_short_link_cache()
+    key = SHORT_LINK_KEY.format(short_code)
+    if shared_cache is not None:
+        recipe_id = shared_cache.get(key)
+    if recipe_id is None:
+        recipe_id = Recipe.objects.filter(
+            short_link=short_code
+        ).values_list('pk', flat=True).first()
+        if recipe_id is None:
+            return None
+        if shared_cache is not None:
+            shared_cache.set(key, recipe_id, settings.SHORT_LINK_CACHE_TTL)
+    short_link_cache.set(short_code, recipe_id)
+    return recipe_id
+
+
+def invalidate_short_link(short_code):
+    short_link_cache.delete(short_code)
+    shared_cache = _shared_short_link_cache()
+    if shared_cache is not None:
+        shared_cache.delete(SHORT_LINK_KEY.format(short_code))
+
+
+def _shared_token_cache():
+    alias = settings.TOKEN_SHARED_CACHE
+    return caches[alias] if alias else None
+
+
+def _token_cache_key(key):
+    # В общем кеше ключи могут быть видны другим сервисам,
+    # поэтому сам токен в имени ключа не хранится.
+    return TOKEN_KEY.format(hashlib.sha256(key.encode()).hexdigest())
+
+
+def get_token(key, cached=True):
+    """Токен с пользователем: память процесса, общий кеш, база.
+
+    С cached=False токен читается из базы, а кеши обновляются.
+    Отдаётся копия, чтобы изменения request.user в одном запросе
+    не попадали в кеш и в другие запросы.
+    """
+    token = token_cache.get(key) if cached else None
+    if token is None:
+        shared_cache = _shared_token_cache()
+        cache_key = _token_cache_key(key)
+        if cached and shared_cache is not None:
+            token = shared_cache.get(cache_key)
+        if token is None:
+            token = Token.objects.select_related('user').filter(
+                key=key
+            ).first()
+            if token is None:
+                if not cached:
+                    invalidate_tokens(key)
+                return None
+            if shared_cache is not None:
+                shared_cache.set(cache_key, token, settings.TOKEN_CACHE_TTL)
+        token_cache.set(key, token)
+    user = copy.copy(token.user)
+    token = copy.copy(token)
+    token.user = user
+    return token
+
+
+def invalidate_tokens(*keys):
+    shared_cache = _shared_token_cache()
+    for key in keys:
+        token_cache.delete(key)
+    if shared_cache is not None:
+        shared_cache.delete_many([_token_cache_key(key) for key in keys])
+
+
+def pin_to_primary(user_id):
+    """Пока изменения доходят до реплик, пользователь читает основную базу."""
+    cache.set(
+        PRIMARY_PIN_KEY.format(user_id), True, settings.REPLICA_PIN_SECONDS
+    )
+
+
+def is_pinned_to_primary(user_id):
+    return cache.get(PRIMARY_PIN_KEY.format(user_id), False)
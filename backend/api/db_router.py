@@ -0,0 +1,32 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# Можно ли читать с реплик. Выставляется ReplicaRoutingMiddleware только
+# на время безопасных запросов, так что management-команды, фоновые
+# потоки и всё, что выполняется до определения пользователя, читают
+# с основной базы.
+use_replicas = ContextVar('use_replicas', default=False)
+
+
+class ReplicaRouter:
+    """Чтение с реплик из DATABASE_REPLICAS, запись в основную базу."""
+
+    def db_for_read(self, model, **hints):
+        if use_replicas.get():
+            return random.choice(settings.DATABASE_REPLICAS)
+        # Явно, а не None: иначе Django взял бы базу объекта из подсказки,
+        # а он мог быть прочитан с реплики в другом запросе и закеширован.
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Реплики получают схему вместе с данными от основной базы.
+        return db not in settings.DATABASE_REPLICAS
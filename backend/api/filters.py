@@ -1,10 +1,34 @@
+from django import forms
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework as rest_framework_filter
-from recipes.models import Ingredient, Recipe
+from recipes.models import Recipe, RecipeTags
+from recipes.search import SEARCH_ORDERING, search_recipes
+
+RECIPE_ORDERINGS = {
+    'popular': ('-popularity', '-id'),
+    'new': ('-pub_date', '-id'),
+    'cooking_time': ('cooking_time', 'id'),
+}
+DEFAULT_RECIPE_ORDERING = 'new'
+
+
+def get_recipe_ordering(request):
+    """Сортировка выдачи рецептов по параметру ?ordering=.
+
+    Без него результаты поиска идут по релевантности.
+    """
+    ordering = request.query_params.get('ordering')
+    if ordering is None and request.query_params.get('search'):
+        return SEARCH_ORDERING
+    return RECIPE_ORDERINGS.get(
+        ordering, RECIPE_ORDERINGS[DEFAULT_RECIPE_ORDERING]
+    )
 
 
 class RecipeFilter(rest_framework_filter.FilterSet):
-    tags = rest_framework_filter.AllValuesMultipleFilter(
-        field_name='tags__slug'
+    tags = rest_framework_filter.Filter(
+        method='filter_tags',
+        widget=forms.SelectMultiple
     )
     is_favorited = rest_framework_filter.BooleanFilter(
         method='filter_is_favorited'
@@ -12,6 +36,23 @@ class RecipeFilter(rest_framework_filter.FilterSet):
     is_in_shopping_cart = rest_framework_filter.BooleanFilter(
         method='filter_is_in_shopping_cart'
     )
+    search = rest_framework_filter.CharFilter(method='filter_search')
+    ordering = rest_framework_filter.ChoiceFilter(
+        choices=(
+            ('popular', 'Популярные'),
+            ('new', 'Новые'),
+            ('cooking_time', 'Время приготовления'),
+        ),
+        method='order_recipes'
+    )
+
+    def filter_tags(self, queryset, name, value):
+        return queryset.filter(Exists(RecipeTags.objects.filter(
+            recipe=OuterRef('pk'), tag__slug__in=value
+        )))
+
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value).order_by(*SEARCH_ORDERING)
 
     def filter_is_favorited(self, queryset, name, value):
         if self.request.user.is_authenticated and value:
@@ -23,16 +64,9 @@ class RecipeFilter(rest_framework_filter.FilterSet):
             return queryset.filter(shopping_cart__user=self.request.user)
         return queryset
 
+    def order_recipes(self, queryset, name, value):
+        return queryset.order_by(*RECIPE_ORDERINGS[value])
+
     class Meta:
         model = Recipe
         fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
-
-
-class IngredientFilter(rest_framework_filter.FilterSet):
-    name = rest_framework_filter.CharFilter(
-        field_name='name', lookup_expr='startswith'
-    )
-
-    class Meta:
-        model = Ingredient
-        fields = ['name']
@@ -0,0 +1,81 @@
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from recipes.models import Ingredient
+
+
+def load_ingredients():
+    """Ингредиенты из базы, отсортированные по названию без учёта регистра.
+
+    Сортировка в Python, а не в SQL: lower() в SQLite не понимает
+    кириллицу.
+    """
+    return sorted(
+        Ingredient.objects.values('id', 'name', 'measurement_unit'),
+        key=lambda item: (item['name'].lower(), item['id'])
+    )
+
+
+class IngredientIndex:
+    """Индекс названий ингредиентов в памяти процесса.
+
+    Держит ингредиенты отсортированными по названию в нижнем регистре,
+    поэтому поиск по началу названия — это бинарный поиск без запросов
+    к базе. Загружается при первом обращении, сбрасывается сигналами
+    при изменении ингредиентов и, на случай изменений из других
+    процессов, перечитывается не реже раза в ttl секунд.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def _load(self):
+        items = load_ingredients()
+        keys = [item['name'].lower() for item in items]
+        return time.monotonic(), keys, items
+
+    def _get_snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is None or time.monotonic() - snapshot[0] > self.ttl:
+            with self._lock:
+                if self._snapshot is snapshot:
+                    self._snapshot = self._load()
+                snapshot = self._snapshot
+        return snapshot
+
+    def peek(self):
+        """Загруженный и не устаревший снимок или None, без похода в базу."""
+        snapshot = self._snapshot
+        if snapshot is None or time.monotonic() - snapshot[0] > self.ttl:
+            return None
+        return snapshot
+
+    def all(self):
+        return self._get_snapshot()[2]
+
+    def search(self, query, limit, snapshot=None):
+        """Сначала совпадения по началу названия, затем по вхождению."""
+        _, keys, items = snapshot or self._get_snapshot()
+        query = query.lower()
+        result = []
+        position = bisect_left(keys, query)
+        while (position < len(keys) and len(result) < limit
+               and keys[position].startswith(query)):
+            result.append(items[position])
+            position += 1
+        for key, item in zip(keys, items):
+            if len(result) >= limit:
+                break
+            if query in key and not key.startswith(query):
+                result.append(item)
+        return result
+
+
+ingredient_index = IngredientIndex(settings.INGREDIENT_INDEX_TTL)
@@ -0,0 +1,496 @@
+import base64
+import io
+import json
+import random
+import resource
+import statistics
+import subprocess
+import threading
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from api.cache import bump_shopping_cart_version
+from api.parsers import Base64JSONParser
+from api.row_serializers import RecipeRowSerializer
+from api.serializers import RecipeSerializer, UploadImageField
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, RequestFactory
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+from recipes.counters import reconcile_counters
+from recipes.models import (Favorites, Ingredient, Recipe, RecipeIngredients,
+                            RecipeTags, ShoppingCart, Subscriptions, Tag, User)
+from recipes.popularity import update_popularity
+from recipes.search import index_recipes
+from rest_framework.authtoken.models import Token
+from rest_framework.parsers import JSONParser, MultiPartParser
+from rest_framework.request import Request
+
+
+class Rollback(Exception):
+    pass
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = round((len(values) - 1) * percent / 100)
+    return values[index]
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу синтетическими данными и замеряет задержки и '
+        'число SQL-запросов основных эндпоинтов API. Результат в JSON. '
+        'По умолчанию все изменения откатываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--output', help='Файл для результата вместо stdout.'
+        )
+        parser.add_argument(
+            '--keep', action='store_true',
+            help='Не откатывать сгенерированные данные.'
+        )
+        parser.add_argument(
+            '--upload-size', type=float, default=4,
+            help='Размер картинки в МБ для замера памяти при загрузке, '
+                 '0 — не замерять.'
+        )
+        parser.add_argument(
+            '--upload-concurrency', type=int, default=8,
+            help='Сколько загрузок разбирается одновременно.'
+        )
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.iterations = options['iterations']
+        self.created_images = []
+        committed = False
+        try:
+            with transaction.atomic():
+                dataset = self.generate(options['users'], options['recipes'])
+                results = self.run_scenarios()
+                results['serializers'] = self.measure_serializers()
+                if not options['keep']:
+                    raise Rollback
+            committed = True
+        except Rollback:
+            pass
+        finally:
+            # Файлы нужны оставленным рецептам и задачам на уменьшенные
+            # копии, удаляем их только вместе с откатом данных.
+            if not committed:
+                for image in self.created_images:
+                    image.storage.delete(image.name)
+        if options['upload_size'] > 0:
+            results['uploads'] = self.measure_uploads(
+                options['upload_size'], options['upload_concurrency']
+            )
+        report = json.dumps({
+            'meta': {
+                'commit': self.get_commit(),
+                'database': connection.vendor,
+                'iterations': self.iterations,
+                'dataset': dataset,
+            },
+            'results': results,
+        }, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(report)
+        else:
+            self.stdout.write(report)
+
+    @staticmethod
+    def get_commit():
+        try:
+            return subprocess.run(
+                ('git', 'rev-parse', 'HEAD'),
+                capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def generate(self, users_count, recipes_count):
+        run = uuid.uuid4().hex[:8]
+        password = make_password('benchmark')
+        User.objects.bulk_create(
+            User(
+                username=f'bench_{run}_{number}',
+                email=f'bench_{run}_{number}@example.com',
+                first_name='Бенчмарк',
+                last_name=str(number),
+                password=password,
+            )
+            for number in range(users_count)
+        )
+        users = list(User.objects.filter(username__startswith=f'bench_{run}_'))
+        tags = list(Tag.objects.all())
+        if len(tags) < 6:
+            Tag.objects.bulk_create(
+                Tag(name=f'Тег {run} {number}', slug=f'bench-{run}-{number}')
+                for number in range(6)
+            )
+            tags = list(Tag.objects.all())
+        ingredients = list(Ingredient.objects.values_list('pk', flat=True))
+        if len(ingredients) < 200:
+            Ingredient.objects.bulk_create(
+                Ingredient(
+                    name=f'ингредиент {run} {number}', measurement_unit='г'
+                )
+                for number in range(200)
+            )
+            ingredients = list(
+                Ingredient.objects.values_list('pk', flat=True)
+            )
+        Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    author=self.random.choice(users),
+                    name=f'Рецепт {run} {number}',
+                    image='recipes/benchmark.png',
+                    text='Описание рецепта для нагрузочного теста. ' * 10,
+                    cooking_time=self.random.randint(5, 180),
+                )
+                for number in range(recipes_count)
+            ),
+            batch_size=500
+        )
+        recipes = list(Recipe.objects.filter(
+            name__startswith=f'Рецепт {run} '
+        ).values_list('pk', flat=True))
+        RecipeIngredients.objects.bulk_create(
+            (
+                RecipeIngredients(
+                    recipe_id=recipe, ingredient_id=ingredient,
+                    amount=self.random.randint(1, 500)
+                )
+                for recipe in recipes
+                for ingredient in self.random.sample(
+                    ingredients, self.random.randint(3, 15)
+                )
+            ),
+            batch_size=1000
+        )
+        RecipeTags.objects.bulk_create(
+            (
+                RecipeTags(recipe_id=recipe, tag=tag)
+                for recipe in recipes
+                for tag in self.random.sample(tags, self.random.randint(1, 3))
+            ),
+            batch_size=1000
+        )
+        for model, count in ((Favorites, 20), (ShoppingCart, 10)):
+            model.objects.bulk_create(
+                (
+                    model(user=user, recipe_id=recipe)
+                    for user in users
+                    for recipe in self.random.sample(
+                        recipes, min(count, len(recipes))
+                    )
+                ),
+                batch_size=1000
+            )
+        Subscriptions.objects.bulk_create(
+            (
+                Subscriptions(user=user, author=author)
+                for user in users
+                for author in self.random.sample(users, min(10, len(users)))
+                if author != user
+            ),
+            batch_size=1000
+        )
+        reconcile_counters()
+        update_popularity()
+        index_recipes(recipes)
+        self.user = users[0]
+        self.tags = tags
+        self.recipes = recipes
+        self.ingredients = ingredients
+        self.client = Client(
+            HTTP_HOST=settings.ALLOWED_HOSTS[0],
+            HTTP_AUTHORIZATION='Token '
+            + Token.objects.get_or_create(user=self.user)[0].key,
+        )
+        return {
+            'users': users_count,
+            'recipes': recipes_count,
+            'recipe_ingredients': RecipeIngredients.objects.filter(
+                recipe_id__in=recipes
+            ).count(),
+        }
+
+    def get_image(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (600, 400), 'orange').save(buffer, 'JPEG')
+        return ('data:image/jpeg;base64,'
+                + base64.b64encode(buffer.getvalue()).decode())
+
+    def get_scenarios(self):
+        image = self.get_image()
+        ingredient_prefixes = [
+            name[:2] for name in Ingredient.objects.filter(
+                pk__in=self.random.sample(self.ingredients, 20)
+            ).values_list('name', flat=True)
+        ]
+        ingredient_list_etag = self.client.get('/api/ingredients/')['ETag']
+
+        def get(url):
+            return lambda: self.client.get(url())
+
+        def create_recipe():
+            response = self.client.post(
+                '/api/recipes/',
+                {
+                    'name': 'Новый рецепт',
+                    'text': 'Описание',
+                    'cooking_time': 10,
+                    'image': image,
+                    'tags': [tag.pk for tag in self.random.sample(
+                        self.tags, 2
+                    )],
+                    'ingredients': [
+                        {'id': ingredient, 'amount': 100}
+                        for ingredient in self.random.sample(
+                            self.ingredients, 10
+                        )
+                    ],
+                },
+                content_type='application/json'
+            )
+            if response.status_code == 201:
+                self.created_images.append(
+                    Recipe.objects.get(pk=response.json()['id']).image
+                )
+            return response
+
+        def cold_shopping_list():
+            bump_shopping_cart_version(self.user.pk)
+            return self.client.get('/api/recipes/download_shopping_cart/')
+
+        return {
+            'recipe_list': get(lambda: '/api/recipes/'),
+            'recipe_list_deep_page': get(
+                lambda: '/api/recipes/?page='
+                f'{max(len(self.recipes) // 6 - 1, 1)}'
+            ),
+            'recipe_list_cursor': get(
+                lambda: '/api/recipes/?pagination=cursor'
+            ),
+            'recipe_list_popular': get(
+                lambda: '/api/recipes/?ordering=popular'
+            ),
+            'recipe_list_popular_cursor': get(
+                lambda: '/api/recipes/?ordering=popular&pagination=cursor'
+            ),
+            'recipe_detail': get(
+                lambda: f'/api/recipes/{self.random.choice(self.recipes)}/'
+            ),
+            'recipe_list_by_tags': get(
+                lambda: '/api/recipes/?' + '&'.join(
+                    f'tags={tag.slug}'
+                    for tag in self.random.sample(self.tags, 2)
+                )
+            ),
+            'recipe_list_favorited': get(
+                lambda: '/api/recipes/?is_favorited=1'
+            ),
+            'feed': get(lambda: '/api/recipes/feed/'),
+            'recipe_search': get(
+                lambda: '/api/recipes/?search='
+                + self.random.choice(ingredient_prefixes)
+            ),
+            'what_to_cook': get(
+                lambda: '/api/recipes/what_to_cook/?' + '&'.join(
+                    f'ingredients={ingredient}'
+                    for ingredient in self.random.sample(self.ingredients, 8)
+                )
+            ),
+            'subscriptions': get(
+                lambda: '/api/users/subscriptions/?recipes_limit=3'
+            ),
+            'tag_list': get(lambda: '/api/tags/'),
+            'ingredient_list': get(lambda: '/api/ingredients/'),
+            'ingredient_list_not_modified': lambda: self.client.get(
+                '/api/ingredients/', HTTP_IF_NONE_MATCH=ingredient_list_etag
+            ),
+            'ingredient_search': get(
+                lambda: '/api/ingredients/?name='
+                + self.random.choice(ingredient_prefixes)
+            ),
+            'shopping_list': get(
+                lambda: '/api/recipes/download_shopping_cart/'
+            ),
+            'shopping_list_uncached': cold_shopping_list,
+            'recipe_create': create_recipe,
+        }
+
+    def measure(self, request):
+        durations = []
+        queries = []
+        statuses = set()
+        for _ in range(self.iterations):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = request()
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                durations.append((time.perf_counter() - started) * 1000)
+            queries.append(len(context.captured_queries))
+            statuses.add(response.status_code)
+        return {
+            'p50_ms': round(percentile(durations, 50), 2),
+            'p90_ms': round(percentile(durations, 90), 2),
+            'p99_ms': round(percentile(durations, 99), 2),
+            'mean_ms': round(statistics.mean(durations), 2),
+            'queries_min': min(queries),
+            'queries_max': max(queries),
+            'statuses': sorted(statuses),
+        }
+
+    def run_scenarios(self):
+        results = {}
+        for name, request in self.get_scenarios().items():
+            self.stderr.write(f'{name}...')
+            results[name] = self.measure(request)
+        return results
+
+    def measure_serializers(self, sample_size=100):
+        """Скорость RecipeSerializer и RecipeRowSerializer на одних рецептах.
+
+        Чтение из базы в замер не входит, только сборка ответа.
+        Совпадение выдачи проверяет RecipeRowSerializerTest.
+        """
+        request = Request(RequestFactory().get(
+            '/api/recipes/', HTTP_HOST=settings.ALLOWED_HOSTS[0]
+        ))
+        request.user = self.user
+        context = {'request': request, 'recipe_image_size': 'card'}
+        queryset = Recipe.objects.with_user_flags(self.user).filter(
+            pk__in=self.recipes[:sample_size]
+        ).order_by('id')
+        recipes = list(queryset)
+        rows = list(RecipeRowSerializer.get_rows(queryset, self.user))
+        row_serializer = RecipeRowSerializer(context)
+        recipe_ids = [row['id'] for row in rows]
+        tags = row_serializer.load_tags(recipe_ids)
+        ingredients = row_serializer.load_ingredients(recipe_ids)
+        serializers = {
+            'model_serializer': lambda: RecipeSerializer(
+                recipes, many=True, context=context
+            ).data,
+            'row_serializer': lambda: row_serializer.build(
+                rows, tags, ingredients
+            ),
+        }
+        results = {'recipes': len(recipes)}
+        for name, serialize in serializers.items():
+            self.stderr.write(f'serializer {name}...')
+            started = time.perf_counter()
+            for _ in range(self.iterations):
+                serialize()
+            duration = time.perf_counter() - started
+            results[f'{name}_recipes_per_s'] = round(
+                len(recipes) * self.iterations / duration
+            )
+        return results
+
+    def get_upload_bodies(self, size_mb):
+        side = int((size_mb * 1024 * 1024 / 3) ** 0.5)
+        buffer = io.BytesIO()
+        Image.frombytes(
+            'RGB', (side, side), self.random.randbytes(side * side * 3)
+        ).save(buffer, 'PNG')
+        image = buffer.getvalue()
+        data_uri = json.dumps({
+            'image': 'data:image/png;base64,'
+            + base64.b64encode(image).decode()
+        }).encode()
+        multipart = encode_multipart(
+            BOUNDARY, {'image': SimpleUploadedFile('image.png', image)}
+        )
+        return {
+            'json_streaming': (
+                Base64JSONParser, UploadImageField, data_uri,
+                'application/json'
+            ),
+            'multipart': (
+                MultiPartParser, UploadImageField, multipart,
+                MULTIPART_CONTENT
+            ),
+            'json_base64_in_memory': (
+                JSONParser, Base64ImageField, data_uri, 'application/json'
+            ),
+        }
+
+    @staticmethod
+    def upload(parser, field, body, content_type, barrier):
+        request = Request(
+            WSGIRequest(RequestFactory()._base_environ(
+                REQUEST_METHOD='POST',
+                CONTENT_TYPE=content_type,
+                CONTENT_LENGTH=str(len(body)),
+                **{'wsgi.input': io.BytesIO(body)}
+            )),
+            parsers=[parser()]
+        )
+        barrier.wait()
+        try:
+            field().run_validation(request.data['image'])
+        finally:
+            request._request.close()
+
+    def measure_uploads(self, size_mb, concurrency):
+        """Пиковая память при одновременном разборе загрузок.
+
+        Пик аллокаций Python считается через tracemalloc отдельно
+        для каждого способа. Пиковый RSS процесса сбросить нельзя,
+        поэтому способы идут от самого экономного, а в отчёт
+        попадает прирост ru_maxrss за время каждого из них.
+        """
+        bodies = self.get_upload_bodies(size_mb)
+        results = {}
+        for name, (parser, field, body, content_type) in bodies.items():
+            self.stderr.write(f'upload {name}...')
+            barrier = threading.Barrier(concurrency)
+            rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            tracemalloc.start()
+            started = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as executor:
+                futures = [
+                    executor.submit(
+                        self.upload, parser, field, body, content_type,
+                        barrier
+                    )
+                    for _ in range(concurrency)
+                ]
+                for future in futures:
+                    future.result()
+            duration = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            results[name] = {
+                'body_mb': round(len(body) / 2 ** 20, 2),
+                'concurrency': concurrency,
+                'duration_ms': round(duration * 1000, 2),
+                'peak_alloc_mb': round(peak / 2 ** 20, 2),
+                'max_rss_growth_mb': round(
+                    (rss_after - rss_before) / 1024, 2
+                ),
+            }
+        return results
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from urllib.parse import quote, urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from recipes.models import Ingredient, Recipe
+
+from .benchmark import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест запущенного сервера: много одновременных '
+        'соединений к самым нагруженным эндпоинтам на чтение. Нужен, '
+        'чтобы сравнить gunicorn с синхронными воркерами и uvicorn '
+        'с ASYNC_VIEWS. Результат в JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--concurrency', type=int, default=100)
+        parser.add_argument('--duration', type=float, default=10)
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--slow-clients', type=int, default=0,
+            help='Сколько соединений всё время шлют запрос по байту, '
+                 'изображая медленных клиентов.'
+        )
+        parser.add_argument(
+            '--slow-interval', type=float, default=0.5,
+            help='Пауза между байтами у медленных клиентов, в секундах.'
+        )
+        parser.add_argument(
+            '--path', action='append', dest='paths',
+            help='Путь для запросов, можно несколько раз. По умолчанию '
+                 'список и карточки рецептов, поиск ингредиентов и '
+                 'короткие ссылки по данным из базы.'
+        )
+        parser.add_argument(
+            '--token', help='Токен для заголовка Authorization.'
+        )
+        parser.add_argument(
+            '--output', help='Файл для результата вместо stdout.'
+        )
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http' or not url.hostname:
+            raise CommandError('Поддерживается только http://host[:port].')
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.timeout = options['timeout']
+        self.random = random.Random(options['seed'])
+        self.headers = f'Host: {url.netloc}\r\nConnection: close\r\n'
+        if options['token']:
+            self.headers += f'Authorization: Token {options["token"]}\r\n'
+        paths = options['paths'] or self.get_default_paths()
+        if not paths:
+            raise CommandError('В базе нет рецептов, укажите --path.')
+        results = asyncio.run(self.run(
+            paths, options['concurrency'], options['duration'],
+            options['slow_clients'], options['slow_interval']
+        ))
+        report = json.dumps({
+            'meta': {
+                'url': options['url'],
+                'concurrency': options['concurrency'],
+                'duration_s': options['duration'],
+                'slow_clients': options['slow_clients'],
+                'paths': len(paths),
+            },
+            'results': results,
+        }, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(report)
+        else:
+            self.stdout.write(report)
+
+    def get_default_paths(self):
+        recipes = list(Recipe.objects.order_by('-id').values_list(
+            'pk', 'short_link'
+        )[:50])
+        names = Ingredient.objects.order_by('?').values_list(
+            'name', flat=True
+        )[:20]
+        paths = ['/api/recipes/', '/api/recipes/?page=2']
+        paths += [f'/api/recipes/{pk}/' for pk, _ in recipes]
+        paths += [
+            f'/s/{short_link}/' for _, short_link in recipes if short_link
+        ]
+        paths += [
+            f'/api/ingredients/?name={quote(name[:2])}' for name in names
+        ]
+        return paths
+
+    async def request(self, path):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            writer.write(f'GET {path} HTTP/1.1\r\n{self.headers}\r\n'.encode())
+            await writer.drain()
+            status_line = await reader.readline()
+            while await reader.read(65536):
+                pass
+        finally:
+            writer.close()
+        return int(status_line.split()[1])
+
+    async def worker(self, paths, deadline, durations, statuses):
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                status = await asyncio.wait_for(
+                    self.request(self.random.choice(paths)), self.timeout
+                )
+            except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+                status = 'error'
+            durations.append((time.perf_counter() - started) * 1000)
+            statuses[status] += 1
+
+    async def slow_client(self, deadline, interval):
+        """Держит соединение, отправляя заголовки запроса по байту."""
+        request = f'GET /api/recipes/ HTTP/1.1\r\n{self.headers}\r\n'.encode()
+        while time.monotonic() < deadline:
+            try:
+                reader, writer = await asyncio.open_connection(
+                    self.host, self.port
+                )
+            except OSError:
+                await asyncio.sleep(interval)
+                continue
+            try:
+                for byte in request:
+                    if time.monotonic() >= deadline:
+                        break
+                    writer.write(bytes((byte,)))
+                    await writer.drain()
+                    await asyncio.sleep(interval)
+            except OSError:
+                pass
+            finally:
+                writer.close()
+
+    async def run(self, paths, concurrency, duration, slow_clients,
+                  slow_interval):
+        deadline = time.monotonic() + duration
+        durations = []
+        statuses = Counter()
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(self.slow_client(deadline, slow_interval)
+              for _ in range(slow_clients)),
+            *(self.worker(paths, deadline, durations, statuses)
+              for _ in range(concurrency)),
+        )
+        elapsed = time.perf_counter() - started
+        if not durations:
+            return {'requests': 0}
+        return {
+            'requests': len(durations),
+            'rps': round(len(durations) / elapsed, 1),
+            'p50_ms': round(percentile(durations, 50), 2),
+            'p90_ms': round(percentile(durations, 90), 2),
+            'p99_ms': round(percentile(durations, 99), 2),
+            'errors': statuses.pop('error', 0),
+            'statuses': {
+                str(status): count
+                for status, count in sorted(statuses.items())
+            },
+        }
@@ -0,0 +1,88 @@
+import threading
+from bisect import bisect_left
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append(
+                f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+            )
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class RouteMetrics:
+
+    def __init__(self):
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.db_duration = Histogram(DURATION_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+
+
+class MetricsRegistry:
+    """Гистограммы по маршрутам, накопленные в памяти процесса."""
+
+    metrics = (
+        ('duration', 'foodgram_request_duration_seconds',
+         'Полное время обработки запроса.'),
+        ('db_duration', 'foodgram_request_db_duration_seconds',
+         'Время SQL-запросов за время обработки запроса.'),
+        ('queries', 'foodgram_request_queries',
+         'Количество SQL-запросов за запрос.'),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def observe(self, route, method, status, duration, db_duration,
+                queries):
+        key = (route, method, str(status))
+        with self._lock:
+            route_metrics = self._routes.get(key)
+            if route_metrics is None:
+                route_metrics = self._routes[key] = RouteMetrics()
+            route_metrics.duration.observe(duration)
+            route_metrics.db_duration.observe(db_duration)
+            route_metrics.queries.observe(queries)
+
+    def render(self):
+        """Метрики в текстовом формате Prometheus."""
+        lines = []
+        with self._lock:
+            routes = sorted(self._routes.items())
+            for attribute, name, description in self.metrics:
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} histogram')
+                for (route, method, status), route_metrics in routes:
+                    labels = (f'route="{route}",method="{method}",'
+                              f'status="{status}"')
+                    lines += getattr(route_metrics, attribute).render(
+                        name, labels
+                    )
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
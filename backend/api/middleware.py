@@ -0,0 +1,280 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from rest_framework.authentication import get_authorization_header
+from rest_framework.permissions import SAFE_METHODS
+
+from .authentication import CachedTokenAuthentication
+from .cache import get_token, is_pinned_to_primary, pin_to_primary
+from .db_router import use_replicas
+from .metrics import registry
+
+logger = logging.getLogger('api.metrics')
+
+MAX_LOGGED_QUERIES = 500
+
+
+class QueryRecorder:
+    """Обёртка execute_wrapper: считает SQL-запросы и их время.
+
+    Параметры запросов не сохраняются: в них бывают токены, хеши
+    паролей и почта, а текст запросов попадает в лог.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+        self.serialize_duration = None
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            if len(self.queries) < MAX_LOGGED_QUERIES:
+                self.queries.append(sql)
+
+
+# Текущий QueryRecorder. Контекст копируется в потоки sync_to_async,
+# поэтому под ASGI считаются и запросы, выполненные вне потока
+# обработчика.
+current_recorder = ContextVar('current_recorder', default=None)
+
+
+@contextmanager
+def timed_serialization():
+    """Относит время блока, кроме SQL, к serialize в Server-Timing.
+
+    Общего места, где DRF сериализует ответ, нет: serializer.data
+    вызывают сами представления. Поэтому serialize замеряется только
+    в таких блоках, сейчас это RecipeRowSerializer и подписки.
+    """
+    recorder = current_recorder.get()
+    if recorder is None:
+        yield
+        return
+    started = time.perf_counter()
+    db_before = recorder.duration
+    try:
+        yield
+    finally:
+        recorder.serialize_duration = (recorder.serialize_duration or 0) + (
+            time.perf_counter() - started - (recorder.duration - db_before)
+        )
+
+
+def record_query(execute, sql, params, many, context):
+    recorder = current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_query_recorder(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@receiver(connection_created)
+def install_on_connect(connection, **kwargs):
+    install_query_recorder(connection)
+
+
+class QueryMetricsMiddleware:
+    """Замеряет SQL-запросы и время обработки каждого запроса.
+
+    Результат отдаётся клиенту в заголовке Server-Timing: db — время
+    SQL, view — код представления без учёта SQL, render — рендеринг
+    ответа DRF, total — всё вместе. serialize — сборка ответа в блоках
+    timed_serialization; есть только у представлений с такими блоками,
+    у остальных сериализация входит в view. Гистограммы по маршрутам
+    копятся в api.metrics.registry, медленные и тяжёлые по числу
+    запросов обращения логируются вместе с текстом SQL.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Так Django 3.2 отличает асинхронный middleware,
+            # см. django.utils.deprecation.MiddlewareMixin.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        # Соединения, открытые до загрузки middleware, например
+        # в management-командах, сигнал connection_created пропустил.
+        for connection in connections.all():
+            install_query_recorder(connection)
+        recorder, started, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        return self.finish(request, response, recorder, started)
+
+    async def __acall__(self, request):
+        recorder, started, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        return self.finish(request, response, recorder, started)
+
+    @staticmethod
+    def start(request):
+        recorder = QueryRecorder()
+        request.query_recorder = recorder
+        return recorder, time.perf_counter(), current_recorder.set(recorder)
+
+    def finish(self, request, response, recorder, started):
+        finished = time.perf_counter()
+        timings = getattr(request, 'view_timings', None)
+        if timings is None and hasattr(request, 'view_started'):
+            view_started, db_before = request.view_started
+            timings = (view_started, recorder.duration - db_before, finished)
+        serialize = recorder.serialize_duration
+        view = render = 0
+        if timings is not None:
+            view_started, view_db, view_finished = timings
+            view = max(
+                view_finished - view_started - view_db - (serialize or 0), 0
+            )
+            render = finished - view_finished
+        total = finished - started
+        entries = [
+            f'db;dur={recorder.duration * 1000:.1f};'
+            f'desc="{recorder.count} queries"',
+            f'view;dur={view * 1000:.1f}',
+            f'render;dur={render * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ]
+        if serialize is not None:
+            entries.insert(1, f'serialize;dur={serialize * 1000:.1f}')
+        response['Server-Timing'] = ', '.join(entries)
+        match = request.resolver_match
+        route = match.view_name if match else 'unmatched'
+        registry.observe(
+            route, request.method, response.status_code,
+            total, recorder.duration, recorder.count
+        )
+        if (total * 1000 >= settings.SLOW_REQUEST_MS
+                or recorder.count >= settings.SLOW_REQUEST_QUERIES):
+            logger.warning(
+                '%s %s: %.1f ms, %d queries (%.1f ms)\n%s',
+                request.method, request.get_full_path(), total * 1000,
+                recorder.count, recorder.duration * 1000,
+                '\n'.join(recorder.queries)
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.view_started = (
+            time.perf_counter(), request.query_recorder.duration
+        )
+
+    def process_template_response(self, request, response):
+        started, db_before = request.view_started
+        request.view_timings = (
+            started,
+            request.query_recorder.duration - db_before,
+            time.perf_counter(),
+        )
+        return response
+
+
+def get_user_id(request):
+    """id пользователя по заголовку с токеном или сессии, до DRF."""
+    auth = get_authorization_header(request).split()
+    if auth:
+        keyword = CachedTokenAuthentication.keyword.lower().encode()
+        if len(auth) != 2 or auth[0].lower() != keyword:
+            return None
+        try:
+            token = get_token(auth[1].decode())
+        except UnicodeError:
+            return None
+        return token.user_id if token is not None else None
+    if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+        return None
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return None
+    return user.pk
+
+
+class ReplicaRoutingMiddleware:
+    """Отправляет чтения безопасных запросов на реплики базы.
+
+    Изменяющие запросы целиком идут в основную базу, а их автор ещё
+    REPLICA_PIN_SECONDS читает только из неё, чтобы сразу видеть свои
+    изменения. Пользователь определяется до включения реплик, поэтому
+    токен и сессия всегда читаются из основной базы. Должен стоять
+    после AuthenticationMiddleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = use_replicas.set(self.can_use_replicas(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            use_replicas.reset(token)
+        if request.method not in SAFE_METHODS:
+            self.pin_writer(request)
+        return response
+
+    async def __acall__(self, request):
+        if (request.method in SAFE_METHODS
+                and ('HTTP_AUTHORIZATION' in request.META
+                     or settings.SESSION_COOKIE_NAME in request.COOKIES)):
+            allowed = await sync_to_async(self.can_use_replicas)(request)
+        else:
+            allowed = self.can_use_replicas(request)
+        token = use_replicas.set(allowed)
+        try:
+            response = await self.get_response(request)
+        finally:
+            use_replicas.reset(token)
+        if request.method not in SAFE_METHODS:
+            await sync_to_async(self.pin_writer)(request)
+        return response
+
+    @staticmethod
+    def can_use_replicas(request):
+        if request.method not in SAFE_METHODS:
+            return False
+        user_id = get_user_id(request)
+        return user_id is None or not is_pinned_to_primary(user_id)
+
+    @staticmethod
+    def pin_writer(request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            pin_to_primary(user.pk)
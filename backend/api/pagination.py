@@ -1,5 +1,133 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (CursorPagination, PageNumberPagination,
+                                       _reverse_ordering)
+from rest_framework.response import Response
+
+
+class KeysetPagination(CursorPagination):
+    """Постраничный вывод по курсору без COUNT(*) и OFFSET.
+
+    Сортировка берётся из атрибута cursor_ordering представления,
+    общее количество считается только по запросу ?count=true.
+    В отличие от CursorPagination курсор хранит значения всех полей
+    сортировки, а не только первого: иначе при равных pub_date или
+    popularity DRF добирает страницу через OFFSET.
+    """
+
+    page_size_query_param = 'limit'
+    ordering = ('-id',)
+
+    def get_ordering(self, request, queryset, view):
+        return tuple(getattr(view, 'cursor_ordering', self.ordering))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get('count', '').lower() == 'true':
+            self.count = queryset.count()
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        position = None if self.cursor is None else self.cursor.position
+        ordering = (
+            _reverse_ordering(self.ordering) if reverse else self.ordering
+        )
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            try:
+                queryset = queryset.filter(
+                    self.get_position_filter(ordering, position)
+                )
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        following_position = None
+        if len(results) > len(self.page):
+            following_position = self._get_position_from_instance(
+                results[-1], self.ordering
+            )
+        # Позиция уникальна, поэтому смещение в курсоре всегда нулевое,
+        # а соседние позиции — это просто курсор и следующая строка.
+        if reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = following_position is not None
+            self.next_position = position
+            self.previous_position = following_position
+        else:
+            self.has_next = following_position is not None
+            self.has_previous = position is not None
+            self.next_position = following_position
+            self.previous_position = position
+        return self.page
+
+    def decode_cursor(self, request):
+        cursor = super().decode_cursor(request)
+        if cursor is None or cursor.position is None:
+            return cursor
+        try:
+            values = json.loads(cursor.position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if (not isinstance(values, list)
+                or len(values) != len(self.ordering)):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def get_position_filter(self, ordering, position):
+        """Строки строго после позиции: (a, b) > (x, y) как
+        a > x OR (a = x AND b > y) с учётом направления каждого поля."""
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, json.loads(position)):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def _get_position_from_instance(self, instance, ordering):
+        if isinstance(instance, dict):
+            values = [instance[field.lstrip('-')] for field in ordering]
+        else:
+            values = [getattr(instance, field.lstrip('-'))
+                      for field in ordering]
+        return json.dumps([str(value) for value in values])
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
 
 
 class Pagination(PageNumberPagination):
+    """Постраничный вывод по номеру страницы или, с ?pagination=cursor,
+    по курсору (см. KeysetPagination)."""
+
     page_size_query_param = 'limit'
+    keyset_pagination_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if (request.query_params.get('pagination') == 'cursor'
+                or self.keyset_pagination_class.cursor_query_param
+                in request.query_params):
+            self.keyset = self.keyset_pagination_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
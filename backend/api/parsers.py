@@ -0,0 +1,200 @@
+import base64
+import binascii
+import re
+import uuid
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.utils import json
+
+DATA_URI = re.compile(rb'data:([\w.+-]+)(?:\\?/([\w.+-]+))?;base64,')
+STRING_SPECIALS = re.compile(rb'["\\]')
+DATA_URI_PREFIX_LIMIT = 128
+FIELD_KEY_LIMIT = 256
+INVALID_BASE64 = 'Некорректные данные base64.'
+
+
+class DataURIExtractor:
+    """Вырезает из потока JSON строки вида data:...;base64,...
+
+    Вырезаются только значения ключей из fields, остальные строки,
+    даже похожие на data URI, остаются строками. Содержимое по частям
+    декодируется во временные файлы, а в документ вместо него
+    подставляются метки. В памяти остаётся только JSON без картинок
+    и хвост base64 короче четырёх символов.
+    """
+
+    OUTSIDE, PREFIX, STRING, BASE64 = range(4)
+
+    def __init__(self, fields):
+        self.field_key = re.compile(
+            rb'"(?:' + b'|'.join(re.escape(field.encode()) for field in fields)
+            + rb')"\s*:\s*\Z'
+        )
+        self.marker = uuid.uuid4().hex
+        self.files = {}
+        self.document = bytearray()
+        self.buffer = b''
+        self.state = self.OUTSIDE
+        self.file = None
+        self.carry = b''
+
+    def feed(self, chunk, final=False):
+        self.buffer += chunk
+        while self.buffer and self._step(final):
+            pass
+
+    def close(self):
+        self.feed(b'', final=True)
+        if self.state == self.BASE64:
+            raise ParseError(INVALID_BASE64)
+        if self.state == self.PREFIX:
+            self.document += b'"'
+        self.document += self.buffer
+        return bytes(self.document)
+
+    def restore(self, value):
+        """Подставляет файлы на место меток в разобранном JSON."""
+        if isinstance(value, dict):
+            return {key: self.restore(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.restore(item) for item in value]
+        if isinstance(value, str):
+            return self.files.get(value, value)
+        return value
+
+    def _step(self, final):
+        if self.state == self.OUTSIDE:
+            return self._outside()
+        if self.state == self.PREFIX:
+            return self._prefix(final)
+        if self.state == self.STRING:
+            return self._string(final)
+        return self._base64()
+
+    def _outside(self):
+        index = self.buffer.find(b'"')
+        if index < 0:
+            self.document += self.buffer
+            self.buffer = b''
+            return False
+        self.document += self.buffer[:index]
+        self.buffer = self.buffer[index + 1:]
+        if self.field_key.search(self.document[-FIELD_KEY_LIMIT:]):
+            self.state = self.PREFIX
+        else:
+            self.document += b'"'
+            self.state = self.STRING
+        return True
+
+    def _prefix(self, final):
+        match = DATA_URI.match(self.buffer)
+        if match:
+            self._open_file(*match.groups())
+            self.buffer = self.buffer[match.end():]
+            self.state = self.BASE64
+            return True
+        if (len(self.buffer) < DATA_URI_PREFIX_LIMIT
+                and b'"' not in self.buffer and not final):
+            return False
+        self.document += b'"'
+        self.state = self.STRING
+        return True
+
+    def _string(self, final):
+        match = STRING_SPECIALS.search(self.buffer)
+        if match is None:
+            self.document += self.buffer
+            self.buffer = b''
+            return False
+        end = match.end()
+        if match.group() == b'\\':
+            if end == len(self.buffer) and not final:
+                self.document += self.buffer[:match.start()]
+                self.buffer = self.buffer[match.start():]
+                return False
+            end += 1
+        else:
+            self.state = self.OUTSIDE
+        self.document += self.buffer[:end]
+        self.buffer = self.buffer[end:]
+        return True
+
+    def _base64(self):
+        index = self.buffer.find(b'"')
+        data = self.buffer if index < 0 else self.buffer[:index]
+        rest = b''
+        if index < 0 and data.endswith(b'\\'):
+            data, rest = data[:-1], b'\\'
+        data = self.carry + data.replace(b'\\/', b'/').replace(b'\\n', b'')
+        size = len(data) // 4 * 4
+        self._write(data[:size])
+        self.carry = data[size:]
+        if index < 0:
+            self.buffer = rest
+            return False
+        if self.carry:
+            # Длина base64 с дополнением всегда кратна четырём.
+            raise ParseError(INVALID_BASE64)
+        token = f'{self.marker}:{len(self.files)}'
+        self.file.size = self.file.tell()
+        self.file.seek(0)
+        self.files[token] = self.file
+        self.document += b'"' + token.encode() + b'"'
+        self.buffer = self.buffer[index + 1:]
+        self.state = self.OUTSIDE
+        self.file = None
+        self.carry = b''
+        return True
+
+    def _open_file(self, main_type, subtype):
+        main_type = main_type.decode()
+        subtype = subtype.decode() if subtype else None
+        self.file = TemporaryUploadedFile(
+            f'{uuid.uuid4()}.{subtype or "bin"}',
+            f'{main_type}/{subtype}' if subtype else main_type,
+            0, None
+        )
+
+    def _write(self, data):
+        try:
+            self.file.write(base64.b64decode(data, validate=True))
+        except binascii.Error:
+            raise ParseError(INVALID_BASE64)
+
+
+class Base64JSONParser(JSONParser):
+    """JSON-парсер, который не держит картинки в base64 в памяти.
+
+    Тело читается кусками по chunk_size, строки data:...;base64,...
+    в полях file_fields сразу декодируются во временные файлы
+    и попадают в request.data как загруженные файлы, так же как при
+    multipart-запросе.
+    """
+
+    chunk_size = 64 * 1024
+    file_fields = ('image', 'avatar')
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        extractor = DataURIExtractor(self.file_fields)
+        for chunk in iter(lambda: stream.read(self.chunk_size), b''):
+            extractor.feed(chunk)
+        document = extractor.close()
+        try:
+            parse_constant = json.strict_constant if self.strict else None
+            data = json.loads(
+                document.decode(encoding), parse_constant=parse_constant
+            )
+        except ValueError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+        request = parser_context.get('request')
+        if request is not None:
+            # HttpRequest.close() закроет и удалит временные файлы
+            # в конце запроса, как делает это для файлов multipart.
+            for token, file in extractor.files.items():
+                request._request.FILES.appendlist(token, file)
+        return extractor.restore(data)
@@ -0,0 +1,181 @@
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from recipes.models import RecipeIngredients
+
+DENSE_RATIO = 32
+
+
+def to_bitset(recipe_ids):
+    """Множество id рецептов в виде int, где бит с номером id равен 1."""
+    buffer = bytearray()
+    for recipe_id in recipe_ids:
+        index = recipe_id >> 3
+        if index >= len(buffer):
+            buffer.extend(bytes(index + 1 - len(buffer)))
+        buffer[index] |= 1 << (recipe_id & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def iter_bits(bitset):
+    """id рецептов из битового множества, от больших к меньшим."""
+    while bitset:
+        recipe_id = bitset.bit_length() - 1
+        yield recipe_id
+        bitset ^= 1 << recipe_id
+
+
+class RecipeIngredientIndex:
+    """Обратный индекс «ингредиент → рецепты» в памяти процесса.
+
+    Для каждого ингредиента хранится массив id рецептов (array('I'),
+    по 4 байта на связь), для популярных ингредиентов, где так
+    компактнее, — ещё и битовое множество в виде int. Рецепты
+    сгруппированы по числу ингредиентов тоже в битовые множества.
+    Поиск складывает множества выбранных продуктов побитовым
+    сумматором: k-й int хранит k-й бит числа совпадений у каждого
+    рецепта, поэтому вся работа идёт над целыми числами на C, без
+    цикла Python по рецептам и без запросов к базе.
+
+    Изменения рецептов этого процесса вносятся точечно через
+    update_recipe(), изменения из других процессов подхватываются
+    полной перезагрузкой раз в ttl секунд: пока она идёт, остальные
+    запросы работают со старыми данными.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def _load(self):
+        postings = {}
+        recipes = {}
+        rows = RecipeIngredients.objects.order_by().values_list(
+            'recipe_id', 'ingredient_id'
+        )
+        for recipe_id, ingredient_id in rows.iterator(chunk_size=10000):
+            postings.setdefault(ingredient_id, array('I')).append(recipe_id)
+            recipes.setdefault(recipe_id, array('I')).append(ingredient_id)
+        max_id = max(recipes, default=0)
+        bitsets = {
+            ingredient_id: to_bitset(recipe_ids)
+            for ingredient_id, recipe_ids in postings.items()
+            if len(recipe_ids) * DENSE_RATIO > max_id
+        }
+        by_size = {}
+        for recipe_id, ingredient_ids in recipes.items():
+            by_size.setdefault(len(ingredient_ids), []).append(recipe_id)
+        sizes = {
+            size: to_bitset(recipe_ids)
+            for size, recipe_ids in by_size.items()
+        }
+        return time.monotonic(), postings, bitsets, recipes, sizes
+
+    def _get_snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._load()
+                return self._snapshot
+        if (time.monotonic() - snapshot[0] > self.ttl
+                and self._lock.acquire(blocking=False)):
+            try:
+                if self._snapshot is snapshot:
+                    self._snapshot = self._load()
+                snapshot = self._snapshot
+            finally:
+                self._lock.release()
+        return snapshot
+
+    def update_recipe(self, recipe_id):
+        """Перечитывает ингредиенты одного рецепта после его изменения.
+
+        Массивы и множества не меняются на месте, а заменяются новыми,
+        поэтому параллельный поиск видит либо старую, либо новую версию.
+        """
+        with self._lock:
+            if self._snapshot is None:
+                return
+            _, postings, bitsets, recipes, sizes = self._snapshot
+            new = array('I', RecipeIngredients.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('ingredient_id', flat=True))
+            old = recipes.get(recipe_id, ())
+            bit = 1 << recipe_id
+            for ingredient_id in set(old) - set(new):
+                postings[ingredient_id] = array('I', (
+                    pk for pk in postings[ingredient_id] if pk != recipe_id
+                ))
+                if ingredient_id in bitsets:
+                    bitsets[ingredient_id] &= ~bit
+            for ingredient_id in set(new) - set(old):
+                postings[ingredient_id] = postings.get(
+                    ingredient_id, array('I')
+                ) + array('I', (recipe_id,))
+                if ingredient_id in bitsets:
+                    bitsets[ingredient_id] |= bit
+            if len(old) != len(new):
+                if old:
+                    sizes[len(old)] &= ~bit
+                if new:
+                    sizes[len(new)] = sizes.get(len(new), 0) | bit
+            if new:
+                recipes[recipe_id] = new
+            else:
+                recipes.pop(recipe_id, None)
+
+    def search(self, ingredient_ids, limit, max_missing=None):
+        """Рецепты, которым из ingredient_ids не хватает меньше всего.
+
+        Возвращает кортежи (id рецепта, совпало, не хватает),
+        отсортированные по числу недостающих, затем по числу
+        совпавших ингредиентов и от новых рецептов к старым.
+        """
+        _, postings, bitsets, _, sizes = self._get_snapshot()
+        planes = []
+        for ingredient_id in set(ingredient_ids):
+            carry = bitsets.get(ingredient_id)
+            if carry is None:
+                carry = to_bitset(postings.get(ingredient_id, ()))
+            for index, plane in enumerate(planes):
+                if not carry:
+                    break
+                planes[index], carry = plane ^ carry, plane & carry
+            if carry:
+                planes.append(carry)
+        matched_sets = {}
+
+        def recipes_matching(matched):
+            if matched not in matched_sets:
+                bitset = -1
+                for index, plane in enumerate(planes):
+                    bitset &= plane if matched >> index & 1 else ~plane
+                matched_sets[matched] = bitset
+            return matched_sets[matched]
+
+        most_matched = (1 << len(planes)) - 1
+        most_missing = max(sizes, default=0)
+        if max_missing is not None:
+            most_missing = min(most_missing, max_missing)
+        result = []
+        for missing in range(most_missing + 1):
+            for size in sorted(sizes, reverse=True):
+                matched = size - missing
+                if not 0 < matched <= most_matched:
+                    continue
+                bitset = sizes[size] & recipes_matching(matched)
+                for recipe_id in iter_bits(bitset):
+                    if len(result) == limit:
+                        return result
+                    result.append((recipe_id, matched, missing))
+        return result
+
+
+recipe_ingredient_index = RecipeIngredientIndex(settings.RECIPE_INDEX_TTL)
@@ -0,0 +1,100 @@
+import gzip
+import hashlib
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from recipes.models import Ingredient, Tag
+from rest_framework.renderers import JSONRenderer
+
+from .cache import get_reference_version
+from .ingredient_index import load_ingredients
+from .serializers import TagSerializer
+
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+
+
+class PrecompiledJSON:
+    """Готовый JSON-ответ со справочником в памяти процесса.
+
+    Тело рендерится и сжимается gzip один раз на версию справочника,
+    ETag — хеш содержимого, поэтому у всех процессов он одинаков.
+    Версия из кеша меняется сигналами и сразу видна в этом процессе,
+    а изменения из других процессов (load_tags, shell, админка другого
+    воркера) замечаются по числу строк и наибольшему id в базе не реже
+    раза в REFERENCE_CHECK_INTERVAL секунд. Правки существующих строк
+    без общего кеша подхватываются пересборкой через REFERENCE_TTL.
+    """
+
+    def __init__(self, name, model, load):
+        self.name = name
+        self.model = model
+        self.load = load
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._checked_at = 0
+
+    def _get_fingerprint(self):
+        return tuple(self.model.objects.aggregate(
+            count=Count('pk'), last=Max('pk')
+        ).values())
+
+    def _build(self, version):
+        key = (version, self._get_fingerprint())
+        body = JSONRenderer().render(self.load())
+        etag = f'W/"{hashlib.sha256(body).hexdigest()[:32]}"'
+        return key, time.monotonic(), etag, body, gzip.compress(body, mtime=0)
+
+    def _is_current(self, snapshot, version):
+        if snapshot is None or snapshot[0][0] != version:
+            return False
+        now = time.monotonic()
+        if now - snapshot[1] > settings.REFERENCE_TTL:
+            return False
+        if now - self._checked_at < settings.REFERENCE_CHECK_INTERVAL:
+            return True
+        self._checked_at = now
+        return snapshot[0][1] == self._get_fingerprint()
+
+    def _get_snapshot(self):
+        version = get_reference_version(self.name)
+        snapshot = self._snapshot
+        if not self._is_current(snapshot, version):
+            with self._lock:
+                if self._snapshot is snapshot:
+                    self._snapshot = self._build(version)
+                    self._checked_at = self._snapshot[1]
+                snapshot = self._snapshot
+        return snapshot
+
+    def response(self, request):
+        """Ответ 200 с телом (сжатым, если клиент умеет gzip) или 304."""
+        _, _, etag, body, compressed = self._get_snapshot()
+        accepts_gzip = ACCEPTS_GZIP.search(
+            request.META.get('HTTP_ACCEPT_ENCODING', '')
+        )
+        response = HttpResponse(
+            compressed if accepts_gzip else body,
+            content_type='application/json'
+        )
+        if accepts_gzip:
+            response['Content-Encoding'] = 'gzip'
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept-Encoding',))
+        patch_cache_control(
+            response, public=True, max_age=settings.REFERENCE_CACHE_MAX_AGE
+        )
+        return get_conditional_response(
+            request, etag=etag, response=response
+        )
+
+
+tag_list = PrecompiledJSON(
+    'tags', Tag, lambda: TagSerializer(Tag.objects.all(), many=True).data
+)
+ingredient_list = PrecompiledJSON('ingredients', Ingredient, load_ingredients)
@@ -0,0 +1,181 @@
+import csv
+
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer
+
+SHOPPING_LIST_TITLE = 'Список покупок.'
+PDF_LINES_PER_PAGE = 48
+
+
+def format_ingredient(ingredient):
+    return (f'{ingredient["name"]}'
+            f'({ingredient["measurement_unit"]}):'
+            f'{ingredient["amount"]}')
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """Базовый рендерер списка покупок.
+
+    Подклассы отдают файл потоком через stream(ingredients). render()
+    не реализован: ответы с ошибками отдаются в JSON, рендерер для них
+    подменяет RecipeViewSet.finalize_response().
+    """
+
+    def get_content_type(self):
+        if self.charset:
+            return f'{self.media_type}; charset={self.charset}'
+        return self.media_type
+
+
+class ShoppingListNegotiation(DefaultContentNegotiation):
+    """Если Accept не подходит ни к одному формату, отдаёт первый,
+    как отдавался список покупок до появления других форматов."""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        try:
+            return super().select_renderer(request, renderers, format_suffix)
+        except NotAcceptable:
+            return renderers[0], renderers[0].media_type
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def stream(self, ingredients):
+        yield SHOPPING_LIST_TITLE
+        for ingredient in ingredients:
+            yield '\n' + format_ingredient(ingredient)
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def stream(self, ingredients):
+        writer = csv.writer(_Echo())
+        yield writer.writerow(
+            ('Ингредиент', 'Единица измерения', 'Количество')
+        )
+        for ingredient in ingredients:
+            yield writer.writerow((
+                ingredient['name'],
+                ingredient['measurement_unit'],
+                ingredient['amount'],
+            ))
+
+
+def _pdf_glyph_names():
+    """Имена глифов кириллицы для позиций cp1251 0xA8, 0xB8, 0xC0-0xFF."""
+    upper = [
+        f'/afii{10017 + index + (index >= 6)}' for index in range(32)
+    ]
+    lower = [
+        f'/afii{10065 + index + (index >= 6)}' for index in range(32)
+    ]
+    return ' '.join(
+        ['168 /afii10023 184 /afii10071 192'] + upper + lower
+    )
+
+
+def _pdf_escape(line):
+    encoded = line.encode('cp1251', errors='replace')
+    return (encoded.replace(b'\\', b'\\\\')
+                   .replace(b'(', b'\\(')
+                   .replace(b')', b'\\)'))
+
+
+class _PDFWriter:
+    """Пишет объекты PDF по одному, запоминая их смещения для xref."""
+
+    def __init__(self):
+        self.offsets = {}
+        self.position = 0
+
+    def raw(self, data):
+        self.position += len(data)
+        return data
+
+    def object(self, number, body):
+        self.offsets[number] = self.position
+        return self.raw(
+            b'%d 0 obj\n' % number + body + b'\nendobj\n'
+        )
+
+    def stream_object(self, number, content):
+        return self.object(
+            number,
+            b'<< /Length %d >>\nstream\n' % len(content)
+            + content + b'\nendstream'
+        )
+
+    def xref(self):
+        size = max(self.offsets) + 1
+        start = self.position
+        table = [b'xref\n0 %d\n' % size, b'0000000000 65535 f \n']
+        table += [
+            b'%010d 00000 n \n' % self.offsets[number]
+            for number in range(1, size)
+        ]
+        table.append(
+            b'trailer\n<< /Size %d /Root 1 0 R >>\n' % size
+            + b'startxref\n%d\n%%%%EOF\n' % start
+        )
+        return self.raw(b''.join(table))
+
+
+class PDFShoppingListRenderer(ShoppingListRenderer):
+    """PDF без сторонних библиотек: стандартный шрифт Helvetica
+    с кодировкой cp1251, по PDF_LINES_PER_PAGE строк на страницу."""
+
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+    def _page(self, writer, number, lines):
+        content = b'BT /F1 12 Tf 16 TL 50 790 Td\n' + b''.join(
+            b'(' + _pdf_escape(line) + b') Tj T*\n' for line in lines
+        ) + b'ET'
+        return writer.stream_object(number, content) + writer.object(
+            number + 1,
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+            b'/Resources << /Font << /F1 3 0 R >> >> '
+            b'/Contents %d 0 R >>' % number
+        )
+
+    def stream(self, ingredients):
+        writer = _PDFWriter()
+        yield writer.raw(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        yield writer.object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        yield writer.object(
+            3,
+            b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica '
+            b'/Encoding << /Type /Encoding /BaseEncoding /WinAnsiEncoding '
+            b'/Differences [' + _pdf_glyph_names().encode() + b'] >> >>'
+        )
+        pages = []
+        lines = [SHOPPING_LIST_TITLE, '']
+        for ingredient in ingredients:
+            lines.append(format_ingredient(ingredient))
+            if len(lines) == PDF_LINES_PER_PAGE:
+                pages.append(4 + 2 * len(pages))
+                yield self._page(writer, pages[-1], lines)
+                lines = []
+        if lines or not pages:
+            pages.append(4 + 2 * len(pages))
+            yield self._page(writer, pages[-1], lines)
+        kids = b' '.join(b'%d 0 R' % (number + 1) for number in pages)
+        yield writer.object(
+            2,
+            b'<< /Type /Pages /Kids [' + kids
+            + b'] /Count %d >>' % len(pages)
+        )
+        yield writer.xref()
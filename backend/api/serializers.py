@@ -2,15 +2,27 @@ import base64
 import uuid
 
 from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import UploadedFile
 from django.db import transaction
-from django.db.models import F
 from drf_extra_fields.fields import Base64ImageField
+from recipes.images import derivative_url
 from recipes.models import (Favorites, Ingredient, Recipe, RecipeIngredients,
                             ShoppingCart, Subscriptions, Tag, User)
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from rest_framework.serializers import ModelSerializer, SerializerMethodField
 
+from .cache import bump_shopping_cart_version
+
+
+def get_recipes_limit(request):
+    recipes_limit = request.query_params.get('recipes_limit')
+    try:
+        recipes_limit = int(recipes_limit)
+    except (TypeError, ValueError):
+        return None
+    return recipes_limit if recipes_limit > 0 else None
+
 
 class TagSerializer(ModelSerializer):
     class Meta:
@@ -25,15 +37,61 @@ class IngredientSerializer(ModelSerializer):
 
 
 class RecipeIngredientSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField()
 
     class Meta:
         model = RecipeIngredients
         fields = ('id', 'amount')
 
 
+class UploadImageField(Base64ImageField):
+    """Картинка строкой base64 или уже загруженным файлом.
+
+    Файлом она приходит из multipart-запроса или из Base64JSONParser,
+    который декодирует base64 во временный файл ещё при разборе тела.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, UploadedFile):
+            return serializers.ImageField.to_internal_value(self, data)
+        return super().to_internal_value(data)
+
+
+class DerivativeImageMixin:
+    """Отдаёт URL уменьшенной копии изображения, пока её нет — оригинала.
+
+    Размер берётся из контекста по ключу size_context_key, а если его
+    там нет — из аргумента size.
+    """
+
+    size_context_key = None
+
+    def __init__(self, *args, size=None, **kwargs):
+        self.size = size
+        super().__init__(*args, **kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        size = self.context.get(self.size_context_key, self.size)
+        url = derivative_url(value, size) if size else value.url
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
+class RecipeImageField(DerivativeImageMixin, UploadImageField):
+    size_context_key = 'recipe_image_size'
+
+
+class AvatarImageField(DerivativeImageMixin, serializers.ImageField):
+    pass
+
+
 class UserSerializer(serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField(default=False)
+    avatar = AvatarImageField(size='avatar', read_only=True)
 
     class Meta:
         model = User
@@ -48,6 +106,8 @@ class UserSerializer(serializers.ModelSerializer):
         )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         return bool(
             request
@@ -58,6 +118,8 @@ class UserSerializer(serializers.ModelSerializer):
 
 class AvatarBase64Field(serializers.ImageField):
     def to_internal_value(self, data):
+        if isinstance(data, UploadedFile):
+            return super().to_internal_value(data)
         try:
             format, img_str = data.split(';base64,')
             ext = format.split('/')[-1]
@@ -86,7 +148,7 @@ class RecipeSerializer(ModelSerializer):
     tags = TagSerializer(read_only=True, many=True)
     author = UserSerializer(read_only=True)
     ingredients = SerializerMethodField()
-    image = Base64ImageField()
+    image = RecipeImageField(size='detail')
     is_favorited = SerializerMethodField()
     is_in_shopping_cart = SerializerMethodField()
 
@@ -94,20 +156,24 @@ class RecipeSerializer(ModelSerializer):
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients',
                   'is_favorited', 'is_in_shopping_cart',
-                  'name', 'image', 'text', 'cooking_time')
+                  'name', 'image', 'text', 'cooking_time',
+                  'favorites_count')
         read_only_fields = ('is_favorited', 'is_in_shopping_cart')
 
     def get_ingredients(self, obj):
-        recipe = obj
-        ingredients = recipe.ingredients.values(
-            'id',
-            'name',
-            'measurement_unit',
-            amount=F('recipe__amount'),
-        )
-        return ingredients
+        return [
+            {
+                'id': item.ingredient.id,
+                'name': item.ingredient.name,
+                'measurement_unit': item.ingredient.measurement_unit,
+                'amount': item.amount,
+            }
+            for item in obj.ingredient_list.all()
+        ]
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get('request')
         return bool(
             request
@@ -118,6 +184,8 @@ class RecipeSerializer(ModelSerializer):
         )
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get('request')
         return bool(
             request
@@ -129,13 +197,10 @@ class RecipeSerializer(ModelSerializer):
 
 
 class RecipeCreateSerializer(ModelSerializer):
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True
-    )
+    tags = serializers.ListField(child=serializers.IntegerField())
     author = UserSerializer(read_only=True)
     ingredients = RecipeIngredientSerializer(many=True, required=True)
-    image = Base64ImageField()
+    image = UploadImageField()
 
     class Meta:
         model = Recipe
@@ -152,16 +217,20 @@ class RecipeCreateSerializer(ModelSerializer):
         if not tags:
             raise ValidationError('Необходимо указать хотя бы один тег')
 
-        unique_tag_ids = set([tag.id for tag in tags])
+        unique_tag_ids = set(tags)
         if len(unique_tag_ids) != len(tags):
             raise ValidationError({'tags': 'Повторяющиеся теги в списке.'})
+        missing_tags = unique_tag_ids - set(
+            Tag.objects.filter(pk__in=tags).values_list('pk', flat=True)
+        )
+        if missing_tags:
+            raise ValidationError(
+                {'tags': f'Тегов не существует: {sorted(missing_tags)}.'}
+            )
 
-        ingredients = self.initial_data.get('ingredients')
+        ingredients = data.get('ingredients')
         if not ingredients:
             raise ValidationError('Необходимо указать хотя бы один ингредиент')
-        for ingredient in ingredients:
-            ingredient['id'] = int(ingredient['id'])
-            Ingredient.objects.get(pk=ingredient['id'])
 
         unique_ingredient_ids = set(
             [ingredient['id'] for ingredient in ingredients]
@@ -170,6 +239,14 @@ class RecipeCreateSerializer(ModelSerializer):
             raise ValidationError(
                 {'ingredients': 'Повторяющиеся ингредиенты в списке.'}
             )
+        missing_ingredients = unique_ingredient_ids - set(
+            Ingredient.objects.in_bulk(unique_ingredient_ids)
+        )
+        if missing_ingredients:
+            raise ValidationError({
+                'ingredients': 'Ингредиентов не существует: '
+                               f'{sorted(missing_ingredients)}.'
+            })
 
         return data
 
@@ -180,7 +257,13 @@ class RecipeCreateSerializer(ModelSerializer):
         author = self.context['request'].user
         recipe = Recipe.objects.create(author=author, **validated_data)
         recipe.tags.set(tags)
-        self._set_tags_and_ingredients(recipe, tags, ingredients)
+        RecipeIngredients.objects.bulk_create(
+            [RecipeIngredients(
+                ingredient_id=ingredient_data['id'],
+                recipe=recipe,
+                amount=ingredient_data['amount']
+            ) for ingredient_data in ingredients]
+        )
         return recipe
 
     @transaction.atomic
@@ -188,27 +271,60 @@ class RecipeCreateSerializer(ModelSerializer):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         instance = super().update(instance, validated_data)
-        self._set_tags_and_ingredients(instance, tags, ingredients)
+        instance.tags.set(tags)
+        self._update_ingredients(instance, ingredients)
         return instance
 
     @staticmethod
-    def _set_tags_and_ingredients(recipe, tags, ingredients):
-        recipe.tags.set(tags)
-        recipe.ingredients.clear()
-        RecipeIngredients.objects.bulk_create(
-            [RecipeIngredients(
-                ingredient=ingredient_data['id'],
-                recipe=recipe,
-                amount=ingredient_data['amount']
-            ) for ingredient_data in ingredients]
-        )
+    def _update_ingredients(recipe, ingredients):
+        """Меняет только те строки RecipeIngredients, что отличаются."""
+        amounts = {
+            ingredient_data['id']: ingredient_data['amount']
+            for ingredient_data in ingredients
+        }
+        current = {
+            row.ingredient_id: row for row in recipe.ingredient_list.all()
+        }
+        deleted = [
+            row.pk for ingredient_id, row in current.items()
+            if ingredient_id not in amounts
+        ]
+        changed = []
+        for ingredient_id, row in current.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and amount != row.amount:
+                row.amount = amount
+                changed.append(row)
+        added = [
+            RecipeIngredients(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount
+            )
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in current
+        ]
+        if deleted:
+            RecipeIngredients.objects.filter(pk__in=deleted).delete()
+        if changed:
+            RecipeIngredients.objects.bulk_update(changed, ['amount'])
+        if added:
+            RecipeIngredients.objects.bulk_create(added)
+        if deleted or changed or added:
+            user_ids = list(
+                recipe.shopping_cart.values_list('user_id', flat=True)
+            )
+            transaction.on_commit(
+                lambda: bump_shopping_cart_version(*user_ids)
+            )
 
     def to_representation(self, instance):
+        instance = Recipe.objects.with_user_flags(
+            self.context['request'].user
+        ).get(pk=instance.pk)
         return RecipeSerializer(instance, context=self.context).data
 
 
 class SpecialRecipeSerializer(ModelSerializer):
-    image = Base64ImageField()
+    image = RecipeImageField(size='card')
 
     class Meta:
         model = Recipe
@@ -240,7 +356,6 @@ class SubscriptionsSerializer(serializers.ModelSerializer):
 
 class UserSubscriptionSerializer(UserSerializer):
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
 
     class Meta():
         model = User
@@ -253,26 +368,22 @@ class UserSubscriptionSerializer(UserSerializer):
             'first_name',
             'last_name',
             'email',
+            'recipes_count',
         )
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
     def get_recipes(self, obj):
         request = self.context.get('request')
         if request is None:
             return []
-        recipes_limit = request.query_params.get('recipes_limit')
-        if recipes_limit is not None:
-            try:
-                recipes_limit = int(recipes_limit)
-            except ValueError:
-                recipes_limit = None
-        recipes = (
-            obj.recipes.all()[:recipes_limit]
-            if recipes_limit
-            else obj.recipes.all()
-        )
+        if hasattr(obj, 'recipes_preview'):
+            recipes = obj.recipes_preview
+        else:
+            recipes_limit = get_recipes_limit(request)
+            recipes = (
+                obj.recipes.all()[:recipes_limit]
+                if recipes_limit
+                else obj.recipes.all()
+            )
         return SpecialRecipeSerializer(recipes, many=True).data
 
 
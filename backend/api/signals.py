@@ -0,0 +1,74 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from recipes.models import Ingredient, Recipe, Subscriptions, Tag, User
+from recipes.signals import bulk_loaded
+from rest_framework.authtoken.models import Token
+
+from .cache import (bump_feed_version, bump_reference_version,
+                    invalidate_short_link, invalidate_tokens)
+from .ingredient_index import ingredient_index
+from .recipe_index import recipe_ingredient_index
+
+
+@receiver((post_save, post_delete, bulk_loaded), sender=Ingredient)
+def invalidate_ingredient_index(**kwargs):
+    ingredient_index.invalidate()
+    transaction.on_commit(lambda: bump_reference_version('ingredients'))
+
+
+@receiver((post_save, post_delete, bulk_loaded), sender=Tag)
+def invalidate_tag_list(**kwargs):
+    transaction.on_commit(lambda: bump_reference_version('tags'))
+
+
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipe_short_link(instance, **kwargs):
+    if instance.short_link:
+        invalidate_short_link(instance.short_link)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_followers_feed(instance, created=True, **kwargs):
+    if not created or instance.author_id is None:
+        return
+    follower_ids = list(Subscriptions.objects.filter(
+        author_id=instance.author_id
+    ).values_list('user_id', flat=True))
+    if follower_ids:
+        transaction.on_commit(lambda: bump_feed_version(*follower_ids))
+
+
+@receiver((post_save, post_delete), sender=Subscriptions)
+def invalidate_subscriber_feed(instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: bump_feed_version(user_id))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def update_recipe_ingredient_index(instance, **kwargs):
+    recipe_id = instance.pk
+    transaction.on_commit(
+        lambda: recipe_ingredient_index.update_recipe(recipe_id)
+    )
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(instance, **kwargs):
+    key = instance.key
+    transaction.on_commit(lambda: invalidate_tokens(key))
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(instance, created, update_fields=None, **kwargs):
+    # Смена пароля, блокировка и любые правки профиля должны сразу
+    # дойти до request.user. Обновление last_login при входе — нет.
+    if created or update_fields == frozenset(('last_login',)):
+        return
+    keys = list(Token.objects.filter(user=instance).values_list(
+        'key', flat=True
+    ))
+    if keys:
+        transaction.on_commit(lambda: invalidate_tokens(*keys))
@@ -0,0 +1,1267 @@
+import base64
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from unittest import mock
+from urllib.parse import urlencode
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connection
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.test import (AsyncRequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from recipes.counters import reconcile_counters
+from recipes.images import process_queue
+from recipes.models import (Favorites, Ingredient, Recipe, RecipeIngredients,
+                            ShoppingCart, Subscriptions, Tag, User)
+from recipes.popularity import compute_scores, update_popularity
+from recipes.search import unindex_recipes
+from recipes.short_links import encode_short_link, fallback_short_link
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ParseError
+from rest_framework.permissions import AllowAny
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework.views import APIView
+
+from . import async_views
+from .cache import pin_to_primary, short_link_cache, token_cache
+from .db_router import ReplicaRouter
+from .ingredient_index import ingredient_index
+from .middleware import ReplicaRoutingMiddleware
+from .parsers import Base64JSONParser
+from .recipe_index import RecipeIngredientIndex
+from .serializers import RecipeSerializer, TagSerializer
+
+RECIPES_URL = '/api/recipes/'
+AVATAR_URL = '/api/users/me/avatar/'
+
+
+def png_data_uri():
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), 'red').save(buffer, 'PNG')
+    return (
+        'data:image/png;base64,'
+        + base64.b64encode(buffer.getvalue()).decode()
+    )
+
+
+class TemporaryMediaMixin:
+    """Загруженные в тестах файлы и очередь изображений — во временном
+    каталоге, обработчики очереди не запускаются."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(
+            MEDIA_ROOT=cls.media_root, IMAGE_WORKERS=0,
+            IMAGE_QUEUE_DIR=os.path.join(cls.media_root, 'image_queue')
+        )
+        cls.media_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+
+class RecipeDataMixin:
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.author, cls.other = (
+            User.objects.create_user(
+                username=name, email=f'{name}@example.com',
+                password='pass12345word', first_name=name, last_name=name
+            )
+            for name in ('user', 'author', 'other')
+        )
+        tags = [
+            Tag.objects.create(name=f'Тег {i}', slug=f'tag{i}')
+            for i in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {i}', measurement_unit='г'
+            )
+            for i in range(10)
+        ]
+        cls.recipes = []
+        for i in range(60):
+            recipe = Recipe.objects.create(
+                author=cls.author if i % 2 else cls.other,
+                name=f'Рецепт {i}', image='recipes/test.png',
+                text='Описание', cooking_time=1 + i
+            )
+            recipe.tags.set(tags[:1 + i % 3])
+            RecipeIngredients.objects.bulk_create(
+                RecipeIngredients(
+                    recipe=recipe, ingredient=ingredients[(i + j) % 10],
+                    amount=10 + j
+                )
+                for j in range(1 + i % 4)
+            )
+            cls.recipes.append(recipe)
+        Recipe.objects.filter(
+            pk__in=[recipe.pk for recipe in cls.recipes[::2]]
+        ).update(image_derivatives='recipes/test.png')
+        User.objects.filter(pk=cls.author.pk).update(
+            avatar='avatars/author.png',
+            avatar_derivatives='avatars/author.png'
+        )
+        for recipe in cls.recipes[::3]:
+            Favorites.objects.create(user=cls.user, recipe=recipe)
+        for recipe in cls.recipes[::4]:
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        Subscriptions.objects.create(user=cls.user, author=cls.author)
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.anonymous = APIClient()
+        self.authorized = APIClient()
+        self.authorized.credentials(
+            HTTP_AUTHORIZATION=f'Token {self.token.key}'
+        )
+
+
+class RecipeListQueriesTest(RecipeDataMixin, TestCase):
+    """Число SQL-запросов списка рецептов не зависит от размера страницы."""
+
+    def test_queries_do_not_grow_with_page_size(self):
+        for name, client, expected in (
+            ('anonymous', self.anonymous, 4),
+            ('authorized', self.authorized, 5),
+        ):
+            for limit in (1, 50):
+                with self.subTest(name, limit=limit):
+                    token_cache.clear()
+                    with self.assertNumQueries(expected):
+                        response = client.get(RECIPES_URL, {'limit': limit})
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(len(response.data['results']), limit)
+
+
+class RecipeListOrderingTest(RecipeDataMixin, TestCase):
+    """Страницы списка не теряют и не повторяют рецепты с одной датой."""
+
+    def test_pages_with_equal_pub_date(self):
+        Recipe.objects.update(pub_date=timezone.now())
+        seen = []
+        for page in range(1, 8):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.anonymous.get(
+                    RECIPES_URL, {'limit': 9, 'page': page}
+                )
+            # SQLite и так отдаёт равные строки в одном порядке,
+            # поэтому проверяем, что id есть в ORDER BY.
+            self.assertIn(
+                '"recipes_recipe"."id" DESC', queries[1]['sql']
+            )
+            self.assertEqual(response.status_code, 200)
+            seen += [recipe['id'] for recipe in response.data['results']]
+        self.assertEqual(
+            seen, sorted((recipe.pk for recipe in self.recipes), reverse=True)
+        )
+
+
+class KeysetPaginationTest(RecipeDataMixin, TestCase):
+    """?pagination=cursor проходит весь список без COUNT и OFFSET."""
+
+    def walk(self, url, params):
+        ids = []
+        response = self.authorized.get(
+            url, {'pagination': 'cursor', 'limit': 7, **params}
+        )
+        while True:
+            self.assertEqual(response.status_code, 200)
+            self.assertIsNone(response.data['count'])
+            ids += [item['id'] for item in response.data['results']]
+            if response.data['next'] is None:
+                return ids
+            with CaptureQueriesContext(connection) as queries:
+                response = self.authorized.get(response.data['next'])
+            for query in queries:
+                self.assertNotIn('COUNT(', query['sql'])
+                self.assertNotIn('OFFSET', query['sql'])
+
+    def test_recipes(self):
+        Recipe.objects.update(pub_date=timezone.now())
+        recipes = Recipe.objects.order_by('-pk')
+        for ordering, expected in (
+            ('new', recipes),
+            ('cooking_time', recipes.order_by('cooking_time', 'pk')),
+            ('popular', recipes.order_by('-popularity', '-pk')),
+        ):
+            with self.subTest(ordering):
+                self.assertEqual(
+                    self.walk(RECIPES_URL, {'ordering': ordering}),
+                    list(expected.values_list('pk', flat=True))
+                )
+
+    def test_previous(self):
+        Recipe.objects.update(pub_date=timezone.now())
+        params = {'pagination': 'cursor', 'limit': 7}
+        pages = [self.anonymous.get(RECIPES_URL, params).data]
+        for _ in range(2):
+            pages.append(self.anonymous.get(pages[-1]['next']).data)
+        for page in reversed(pages[:-1]):
+            response = self.anonymous.get(pages[-1]['previous'])
+            self.assertEqual(response.data['results'], page['results'])
+            pages.append(response.data)
+
+    def test_invalid_cursor(self):
+        for position in ('[', '["x"]', '["x", "1"]'):
+            with self.subTest(position):
+                cursor = base64.b64encode(
+                    urlencode({'p': position}).encode()
+                ).decode()
+                response = self.anonymous.get(
+                    RECIPES_URL, {'cursor': cursor}
+                )
+                self.assertEqual(response.status_code, 404)
+
+    def test_filtered_recipes(self):
+        self.assertEqual(
+            self.walk(RECIPES_URL, {'tags': 'tag2'}),
+            list(Recipe.objects.filter(tags__slug='tag2').order_by(
+                '-pub_date', '-pk'
+            ).values_list('pk', flat=True))
+        )
+
+    def test_users(self):
+        # Djoser (HIDE_USERS) показывает весь список только персоналу.
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.assertEqual(
+            self.walk('/api/users/', {}),
+            list(User.objects.order_by('pk').values_list('pk', flat=True))
+        )
+
+    def test_count_on_request(self):
+        response = self.anonymous.get(
+            RECIPES_URL, {'pagination': 'cursor', 'count': 'true'}
+        )
+        self.assertEqual(response.data['count'], len(self.recipes))
+
+
+class ServerTimingTest(RecipeDataMixin, TestCase):
+    """serialize в Server-Timing есть только там, где он замерен."""
+
+    @staticmethod
+    def get_metrics(response):
+        return [
+            entry.split(';')[0]
+            for entry in response['Server-Timing'].split(', ')
+        ]
+
+    def test_metrics(self):
+        for url, client, expected in (
+            (RECIPES_URL, self.anonymous,
+             ['db', 'serialize', 'view', 'render', 'total']),
+            ('/api/users/subscriptions/', self.authorized,
+             ['db', 'serialize', 'view', 'render', 'total']),
+            (f'{RECIPES_URL}{self.recipes[0].pk}/', self.anonymous,
+             ['db', 'serialize', 'view', 'render', 'total']),
+            ('/api/users/me/', self.authorized,
+             ['db', 'view', 'render', 'total']),
+        ):
+            with self.subTest(url):
+                response = client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(self.get_metrics(response), expected)
+
+
+class RecipeRowSerializerTest(RecipeDataMixin, TestCase):
+    """Выдача RecipeRowSerializer совпадает с RecipeSerializer."""
+
+    def get_expected(self, user, recipe_ids, image_size):
+        request = Request(APIRequestFactory().get(RECIPES_URL))
+        request.user = user
+        recipes = Recipe.objects.with_user_flags(user).in_bulk(recipe_ids)
+        data = RecipeSerializer(
+            [recipes[pk] for pk in recipe_ids], many=True,
+            context={'request': request, 'recipe_image_size': image_size}
+        ).data
+        return json.loads(JSONRenderer().render(data))
+
+    def get_clients(self):
+        return (
+            ('anonymous', AnonymousUser(), self.anonymous),
+            ('authorized', self.user, self.authorized),
+        )
+
+    def test_list(self):
+        for name, user, client in self.get_clients():
+            with self.subTest(name):
+                response = client.get(RECIPES_URL, {'limit': 50})
+                self.assertEqual(response.status_code, 200)
+                results = response.json()['results']
+                self.assertEqual(len(results), 50)
+                self.assertEqual(results, self.get_expected(
+                    user, [recipe['id'] for recipe in results], 'card'
+                ))
+
+    def test_detail(self):
+        for name, user, client in self.get_clients():
+            for recipe in self.recipes[:12]:
+                with self.subTest(name, recipe=recipe.pk):
+                    response = client.get(f'{RECIPES_URL}{recipe.pk}/')
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(
+                        [response.json()],
+                        self.get_expected(user, [recipe.pk], 'detail')
+                    )
+
+    def test_derivatives_without_storage_lookups(self):
+        storage = Recipe._meta.get_field('image').storage
+        with mock.patch.object(storage, 'exists', side_effect=AssertionError):
+            results = self.anonymous.get(
+                RECIPES_URL, {'limit': 50}
+            ).json()['results']
+        self.assertEqual(
+            {recipe['image'].rsplit('/', 1)[1] for recipe in results},
+            {'test.png', 'test_card.webp'}
+        )
+        self.assertEqual(
+            {recipe['author']['avatar'] for recipe in results},
+            {None, 'http://testserver/media/avatars/derivatives/'
+                   'author_avatar.webp'}
+        )
+
+    def test_user_flags_are_covered(self):
+        results = self.authorized.get(
+            RECIPES_URL, {'limit': 50}
+        ).json()['results']
+        for flag in ('is_favorited', 'is_in_shopping_cart'):
+            with self.subTest(flag):
+                self.assertEqual(
+                    {recipe[flag] for recipe in results}, {True, False}
+                )
+        self.assertEqual(
+            {recipe['author']['is_subscribed'] for recipe in results},
+            {True, False}
+        )
+
+
+class AuthorReaderMixin(TemporaryMediaMixin):
+    """Автор, который создаёт рецепты через API, и читатель."""
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='pass12345word', first_name='a', last_name='a'
+        )
+        self.reader = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            password='pass12345word', first_name='r', last_name='r'
+        )
+        self.tag = Tag.objects.create(name='Тег', slug='tag')
+        self.ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г'
+        )
+        self.author_client = self.get_client(self.author)
+        self.reader_client = self.get_client(self.reader)
+
+    @staticmethod
+    def get_client(user):
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user)}'
+        )
+        return client
+
+    def get_recipe_data(self, name='Рецепт'):
+        return {
+            'tags': [self.tag.pk],
+            'ingredients': [{'id': self.ingredient.pk, 'amount': 5}],
+            'image': png_data_uri(),
+            'name': name,
+            'text': 'Описание',
+            'cooking_time': 5,
+        }
+
+    def create_recipe(self):
+        response = self.author_client.post(
+            RECIPES_URL, self.get_recipe_data(), format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        return Recipe.objects.get(pk=response.data['id'])
+
+
+class ShoppingListDownloadTest(RecipeDataMixin, TestCase):
+    """Выгрузка списка покупок в разных форматах."""
+
+    URL = f'{RECIPES_URL}download_shopping_cart/'
+
+    def get_expected(self):
+        return list(Ingredient.objects.filter(
+            recipe__recipe__shopping_cart__user=self.user
+        ).values_list('name', 'measurement_unit').annotate(
+            amount=Sum('recipe__amount')
+        ).order_by('name'))
+
+    def download(self, **kwargs):
+        response = self.authorized.get(self.URL, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_text(self):
+        # Как и до появления форматов, без подходящего Accept — текст.
+        for accept in (None, 'text/plain', 'application/json', '*/*'):
+            with self.subTest(accept):
+                kwargs = {'HTTP_ACCEPT': accept} if accept else {}
+                response, content = self.download(**kwargs)
+                self.assertEqual(
+                    response['Content-Type'], 'text/plain; charset=utf-8'
+                )
+                self.assertEqual(content.decode().split('\n'), [
+                    'Список покупок.', *(
+                        f'{name}({unit}):{amount}'
+                        for name, unit, amount in self.get_expected()
+                    )
+                ])
+
+    def test_csv(self):
+        response, content = self.download(HTTP_ACCEPT='text/csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('.csv', response['Content-Disposition'])
+        rows = list(csv.reader(io.StringIO(content.decode())))
+        self.assertEqual(
+            rows[0], ['Ингредиент', 'Единица измерения', 'Количество']
+        )
+        self.assertEqual(rows[1:], [
+            [name, unit, str(amount)]
+            for name, unit, amount in self.get_expected()
+        ])
+
+    def test_pdf(self):
+        response, content = self.download(data={'format': 'pdf'})
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(content.startswith(b'%PDF-1.4\n'))
+        self.assertTrue(content.endswith(b'%%EOF\n'))
+        start = int(content.rsplit(b'startxref\n', 1)[1].split()[0])
+        self.assertTrue(content[start:].startswith(b'xref\n'))
+        name, unit, amount = self.get_expected()[0]
+        self.assertIn(
+            f'({name}\\({unit}\\):{amount}) Tj'.encode('cp1251'), content
+        )
+
+    def test_not_modified(self):
+        response, _ = self.download()
+        etag = response['ETag']
+        response = self.authorized.get(self.URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response, _ = self.download(
+            HTTP_ACCEPT='text/csv', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertNotEqual(response['ETag'], etag)
+        self.authorized.post(
+            f'{RECIPES_URL}{self.recipes[1].pk}/shopping_cart/'
+        )
+        response, _ = self.download(HTTP_IF_NONE_MATCH=etag)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_errors(self):
+        for accept in ('text/csv', 'application/pdf', 'application/json'):
+            with self.subTest(accept):
+                response = self.anonymous.get(self.URL, HTTP_ACCEPT=accept)
+                self.assertEqual(response.status_code, 401)
+                self.assertEqual(
+                    response['Content-Type'], 'application/json'
+                )
+                self.assertIn('detail', response.json())
+        ShoppingCart.objects.filter(user=self.user).delete()
+        response = self.authorized.get(self.URL, HTTP_ACCEPT='text/csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.content, b'')
+
+
+class CounterTest(AuthorReaderMixin, TestCase):
+    """Счётчики в User и Recipe."""
+
+    def test_saves_keep_counters(self):
+        recipe = self.create_recipe()
+        self.reader_client.post(f'{RECIPES_URL}{recipe.pk}/favorite/')
+        self.reader_client.post(f'{RECIPES_URL}{recipe.pk}/shopping_cart/')
+        self.reader_client.post(f'/api/users/{self.author.pk}/subscribe/')
+        self.assertEqual(self.author_client.put(
+            AVATAR_URL, {'avatar': png_data_uri()}, format='json'
+        ).status_code, 200)
+        self.assertEqual(self.author_client.patch(
+            f'{RECIPES_URL}{recipe.pk}/',
+            self.get_recipe_data('Новое название'), format='json'
+        ).status_code, 200)
+        recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(recipe.name, 'Новое название')
+        self.assertEqual(
+            (recipe.favorites_count, recipe.in_carts_count), (1, 1)
+        )
+        self.assertEqual(
+            (self.author.recipes_count, self.author.subscribers_count), (1, 1)
+        )
+
+    def counters(self, recipe):
+        recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        return (
+            recipe.favorites_count, recipe.in_carts_count,
+            self.author.recipes_count, self.author.subscribers_count
+        )
+
+    def test_api_changes_counters(self):
+        recipe = self.create_recipe()
+        self.assertEqual(self.counters(recipe), (0, 0, 1, 0))
+        urls = (
+            f'{RECIPES_URL}{recipe.pk}/favorite/',
+            f'{RECIPES_URL}{recipe.pk}/shopping_cart/',
+            f'/api/users/{self.author.pk}/subscribe/',
+        )
+        for _ in range(2):
+            for url in urls:
+                self.reader_client.post(url)
+        self.assertEqual(self.counters(recipe), (1, 1, 1, 1))
+        for _ in range(2):
+            for url in urls:
+                self.reader_client.delete(url)
+        self.assertEqual(self.counters(recipe), (0, 0, 1, 0))
+        second = self.create_recipe()
+        self.assertEqual(self.counters(second), (0, 0, 2, 0))
+        self.author_client.delete(f'{RECIPES_URL}{recipe.pk}/')
+        self.assertEqual(self.counters(second), (0, 0, 1, 0))
+
+    def test_reconcile(self):
+        recipe = self.create_recipe()
+        self.reader_client.post(f'{RECIPES_URL}{recipe.pk}/favorite/')
+        Recipe.objects.update(favorites_count=5, in_carts_count=2)
+        User.objects.update(recipes_count=0)
+        self.assertEqual(reconcile_counters(), {
+            'Recipe.favorites_count': 1,
+            'Recipe.in_carts_count': 1,
+            'User.recipes_count': 1,
+            'User.subscribers_count': 0,
+        })
+        self.assertEqual(self.counters(recipe), (1, 0, 1, 0))
+        self.assertEqual(set(reconcile_counters(dry_run=True).values()), {0})
+
+
+@override_settings(POPULARITY_HALF_LIFE_DAYS=7, POPULARITY_WINDOW_DAYS=60)
+class PopularityTest(AuthorReaderMixin, TestCase):
+    """Популярность затухает со временем и задаёт ?ordering=popular."""
+
+    NOW = timezone.make_aware(datetime(2026, 1, 15, 12))
+
+    def setUp(self):
+        super().setUp()
+        self.other = User.objects.create_user(
+            username='other', email='other@example.com',
+            password='pass12345word', first_name='o', last_name='o'
+        )
+        self.recipes = [self.create_recipe() for _ in range(4)]
+
+    def add(self, model, user, recipe, days_ago):
+        model.objects.create(user=user, recipe=recipe)
+        model.objects.filter(user=user, recipe=recipe).update(
+            created_at=self.NOW - timedelta(days=days_ago)
+        )
+
+    def test_decay(self):
+        first, second, third, fourth = self.recipes
+        self.add(Favorites, self.reader, first, 0)
+        self.add(ShoppingCart, self.reader, first, 7)
+        self.add(Favorites, self.reader, second, 14)
+        self.add(Favorites, self.other, second, 14)
+        self.add(Favorites, self.reader, third, 61)
+        self.add(Favorites, self.other, third, -1)
+        scores = compute_scores(self.NOW)
+        self.assertEqual(set(scores), {first.pk, second.pk})
+        self.assertAlmostEqual(scores[first.pk], 1.25)
+        self.assertAlmostEqual(scores[second.pk], 0.5)
+
+        Recipe.objects.filter(pk=fourth.pk).update(popularity=3)
+        with mock.patch('recipes.popularity.timezone.now',
+                        return_value=self.NOW):
+            self.assertEqual(update_popularity(), 2)
+        response = APIClient().get(RECIPES_URL, {'ordering': 'popular'})
+        self.assertEqual(
+            [recipe['id'] for recipe in response.data['results']],
+            [first.pk, second.pk, fourth.pk, third.pk]
+        )
+
+    def test_unknown_ordering(self):
+        response = APIClient().get(RECIPES_URL, {'ordering': 'oldest'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ordering', response.data)
+
+
+class FeedTest(AuthorReaderMixin, TestCase):
+    """Лента подписок: только авторы из подписок, начало кешируется."""
+
+    URL = f'{RECIPES_URL}feed/'
+
+    def setUp(self):
+        super().setUp()
+        self.other = User.objects.create_user(
+            username='other', email='other@example.com',
+            password='pass12345word', first_name='o', last_name='o'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.reader_client.post(f'/api/users/{self.author.pk}/subscribe/')
+        self.recipes = [self.create_recipe() for _ in range(3)]
+        self.get_client(self.other).post(
+            RECIPES_URL, self.get_recipe_data(), format='json'
+        )
+
+    def feed(self, url=f'{URL}?limit=2'):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.reader_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']], (
+            response.data['next'], len(queries)
+        )
+
+    def test_followed_authors_only(self):
+        ids, (next_url, _) = self.feed()
+        self.assertEqual(ids, [self.recipes[2].pk, self.recipes[1].pk])
+        ids, (next_url, _) = self.feed(next_url)
+        self.assertEqual(ids, [self.recipes[0].pk])
+        self.assertIsNone(next_url)
+        self.assertEqual(APIClient().get(self.URL).status_code, 401)
+
+    def test_head_cache(self):
+        ids, (_, queries) = self.feed()
+        cached_ids, (_, cached_queries) = self.feed()
+        self.assertEqual(cached_ids, ids)
+        self.assertEqual(cached_queries, queries - 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = self.create_recipe()
+        self.assertEqual(self.feed()[0], [recipe.pk, self.recipes[2].pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author_client.delete(f'{RECIPES_URL}{recipe.pk}/')
+        self.assertEqual(self.feed()[0], ids)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.reader_client.delete(
+                f'/api/users/{self.author.pk}/subscribe/'
+            )
+        self.assertEqual(self.feed()[0], [])
+
+
+class SearchTest(AuthorReaderMixin, TransactionTestCase):
+    """?search= по названию, описанию и ингредиентам, ё равна е.
+
+    Индекс обновляется после коммита, поэтому TransactionTestCase.
+    """
+
+    def tearDown(self):
+        # Очистка базы после теста не трогает таблицу FTS5 в SQLite.
+        unindex_recipes(list(Recipe.objects.values_list('pk', flat=True)))
+        super().tearDown()
+
+    def search(self, value):
+        response = self.reader_client.get(RECIPES_URL, {'search': value})
+        self.assertEqual(response.status_code, 200)
+        return {recipe['id'] for recipe in response.data['results']}
+
+    def create(self, name, text):
+        data = self.get_recipe_data(name)
+        data['text'] = text
+        response = self.author_client.post(RECIPES_URL, data, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def test_search(self):
+        hedgehog = self.create('Ёжик', 'Пирог с зелёным луком')
+        salad = self.create('Салат', 'Нарезать')
+        for value, expected in (
+            ('ежик', {hedgehog}),
+            ('ЁЖ', {hedgehog}),
+            ('зеленым', {hedgehog}),
+            ('соль', {hedgehog, salad}),
+            ('салат соль', {salad}),
+            ('ежик салат', set()),
+            ('!!!', set()),
+        ):
+            with self.subTest(value):
+                self.assertEqual(self.search(value), expected)
+
+    def test_reindex(self):
+        recipe = self.create('Суп', 'Сварить')
+        self.ingredient.name = 'Пёрец'
+        self.ingredient.save()
+        self.assertEqual(self.search('перец'), {recipe})
+        self.assertEqual(self.search('соль'), set())
+        self.author_client.patch(
+            f'{RECIPES_URL}{recipe}/', self.get_recipe_data('Щи'),
+            format='json'
+        )
+        self.assertEqual(self.search('щи'), {recipe})
+        self.assertEqual(self.search('суп'), set())
+        self.author_client.delete(f'{RECIPES_URL}{recipe}/')
+        self.assertEqual(self.search('щи'), set())
+
+
+class ShoppingListCacheTest(AuthorReaderMixin, TestCase):
+    """Список покупок берётся из кеша, пока корзина и рецепты те же."""
+
+    URL = f'{RECIPES_URL}download_shopping_cart/'
+
+    def download(self):
+        # Список читается из базы, пока отдаётся поток.
+        with CaptureQueriesContext(connection) as queries:
+            response = self.reader_client.get(self.URL)
+            if response.status_code != 200:
+                return response.status_code, None
+            content = b''.join(response.streaming_content).decode()
+        aggregated = any('SUM(' in query['sql'] for query in queries)
+        return content, aggregated
+
+    def test_invalidation(self):
+        recipe = self.create_recipe()
+        cart_url = f'{RECIPES_URL}{recipe.pk}/shopping_cart/'
+        self.reader_client.post(cart_url)
+        expected = 'Список покупок.\nСоль(г):5'
+        self.assertEqual(self.download(), (expected, True))
+        self.assertEqual(self.download(), (expected, False))
+        data = self.get_recipe_data()
+        data['ingredients'][0]['amount'] = 7
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author_client.patch(
+                f'{RECIPES_URL}{recipe.pk}/', data, format='json'
+            )
+        expected = 'Список покупок.\nСоль(г):7'
+        self.assertEqual(self.download(), (expected, True))
+        self.assertEqual(self.download(), (expected, False))
+        self.reader_client.delete(cart_url)
+        self.assertEqual(self.download(), (400, None))
+        self.reader_client.post(cart_url)
+        self.assertEqual(self.download(), (expected, True))
+        self.author_client.delete(f'{RECIPES_URL}{recipe.pk}/')
+        self.assertEqual(self.download(), (400, None))
+
+
+class ImageDerivativesTest(AuthorReaderMixin, TestCase):
+    """Уменьшенные копии отдаются после обработки очереди."""
+
+    def test_image_served_after_processing(self):
+        for image_format in ('webp', 'jpeg'):
+            with self.subTest(image_format), override_settings(
+                IMAGE_DERIVATIVE_FORMAT=image_format
+            ):
+                with self.captureOnCommitCallbacks(execute=True):
+                    recipe = self.create_recipe()
+                url = f'{RECIPES_URL}{recipe.pk}/'
+                image = self.reader_client.get(url).data['image']
+                self.assertNotIn('/derivatives/', image)
+                self.assertEqual(process_queue(), 1)
+                recipe.refresh_from_db()
+                self.assertEqual(recipe.image_derivatives, recipe.image.name)
+                image = self.reader_client.get(url).data['image']
+                self.assertTrue(image.endswith(f'_detail.{image_format}'))
+                derivatives = os.path.dirname(os.path.join(
+                    self.media_root, image.split('/media/', 1)[1]
+                ))
+                stem = os.path.basename(recipe.image.name).rsplit('.', 1)[0]
+                self.assertEqual(
+                    sorted(
+                        name for name in os.listdir(derivatives)
+                        if name.startswith(stem + '_')
+                    ),
+                    [f'{stem}_card.{image_format}',
+                     f'{stem}_detail.{image_format}']
+                )
+
+
+@override_settings(REFERENCE_CHECK_INTERVAL=0, REFERENCE_CACHE_MAX_AGE=60)
+class ReferenceListTest(TestCase):
+    """Готовые JSON тегов и ингредиентов: gzip, ETag и пересборка."""
+
+    def setUp(self):
+        cache.clear()
+        self.tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+        Ingredient.objects.create(name='Соль', measurement_unit='г')
+
+    def get(self, url, **headers):
+        response = self.client.get(url, **headers)
+        if response.status_code != 200:
+            return response.status_code, response.content, None
+        content = response.content
+        if response.get('Content-Encoding') == 'gzip':
+            content = gzip.decompress(content)
+        return 200, json.loads(content), response['ETag']
+
+    def test_tags(self):
+        status, data, etag = self.get('/api/tags/')
+        self.assertEqual(
+            data, json.loads(JSONRenderer().render(
+                TagSerializer(Tag.objects.all(), many=True).data
+            ))
+        )
+        self.assertEqual(
+            self.get('/api/tags/', HTTP_ACCEPT_ENCODING='gzip, br'),
+            (200, data, etag)
+        )
+        self.assertEqual(
+            self.get('/api/tags/', HTTP_IF_NONE_MATCH=etag), (304, b'', None)
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.name = 'Ужин'
+            self.tag.save()
+        status, renamed, renamed_etag = self.get(
+            '/api/tags/', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(renamed[0]['name'], 'Ужин')
+        self.assertNotEqual(renamed_etag, etag)
+        # Строки, добавленные в обход сигналов (другим процессом),
+        # замечаются по числу строк и наибольшему id.
+        Tag.objects.bulk_create([Tag(name='Обед', slug='lunch')])
+        self.assertEqual(len(self.get('/api/tags/')[1]), 2)
+
+    def test_ingredients(self):
+        response = self.client.get('/api/ingredients/')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        status, data, etag = self.get('/api/ingredients/')
+        self.assertEqual(
+            [ingredient['name'] for ingredient in data], ['Соль']
+        )
+        self.assertEqual(self.get(
+            '/api/ingredients/', HTTP_IF_NONE_MATCH=etag
+        )[0], 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='Перец', measurement_unit='г')
+        self.assertEqual(
+            [ingredient['name'] for ingredient in self.get(
+                '/api/ingredients/', HTTP_IF_NONE_MATCH=etag
+            )[1]],
+            ['Перец', 'Соль']
+        )
+
+
+class TokenCacheTest(TestCase):
+    """Кеш токенов не пропускает вышедших и заблокированных."""
+
+    ME_URL = '/api/users/me/'
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.user = User.objects.create_user(
+            username='user', email='user@example.com',
+            password='pass12345word', first_name='Имя', last_name='Ф'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+        self.assertEqual(self.client.get(self.ME_URL).status_code, 200)
+
+    def test_logout(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get(self.ME_URL).status_code, 401)
+
+    def test_deactivation(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get(self.ME_URL).status_code, 401)
+
+    def test_profile_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Другое'
+            self.user.save()
+        self.assertEqual(
+            self.client.get(self.ME_URL).data['first_name'], 'Другое'
+        )
+
+    def test_writes_do_not_use_cached_user(self):
+        # Так выглядит блокировка из другого процесса без общего кеша:
+        # сигнал до кеша этого процесса не доходит.
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get(self.ME_URL).status_code, 200)
+        response = self.client.put(
+            AVATAR_URL, {'avatar': png_data_uri()}, format='json'
+        )
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.client.get(self.ME_URL).status_code, 401)
+
+
+class RecipeIngredientIndexTest(TestCase):
+    """Поиск по индексу совпадает с перебором всех рецептов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='pass12345word', first_name='a', last_name='a'
+        )
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {i}',
+                                      measurement_unit='г')
+            for i in range(30)
+        ]
+        # Редкие id, чтобы у индекса были и массивы, и битовые множества.
+        rng = random.Random(1)
+        for pk in rng.sample(range(1, 3000), 120):
+            cls.create_recipe(pk, rng)
+
+    def setUp(self):
+        self.random = random.Random(2)
+
+    @classmethod
+    def create_recipe(cls, pk, rng):
+        Recipe.objects.create(
+            pk=pk, author=cls.author, name=f'Рецепт {pk}',
+            image='recipes/test.png', text='Описание', cooking_time=1
+        )
+        cls.set_ingredients(pk, rng)
+
+    @classmethod
+    def set_ingredients(cls, pk, rng):
+        RecipeIngredients.objects.filter(recipe_id=pk).delete()
+        # Первый ингредиент есть почти везде, остальные — изредка.
+        ingredients = rng.sample(cls.ingredients[1:], rng.randint(0, 6))
+        if rng.random() < 0.9:
+            ingredients.append(cls.ingredients[0])
+        RecipeIngredients.objects.bulk_create(
+            RecipeIngredients(recipe_id=pk, ingredient=ingredient, amount=1)
+            for ingredient in ingredients
+        )
+
+    @staticmethod
+    def brute_force(ingredient_ids, limit, max_missing):
+        recipes = {}
+        for recipe_id, ingredient_id in RecipeIngredients.objects.values_list(
+            'recipe_id', 'ingredient_id'
+        ):
+            recipes.setdefault(recipe_id, set()).add(ingredient_id)
+        result = []
+        for recipe_id, recipe_ingredients in recipes.items():
+            matched = len(recipe_ingredients & set(ingredient_ids))
+            missing = len(recipe_ingredients) - matched
+            if matched and (max_missing is None or missing <= max_missing):
+                result.append((recipe_id, matched, missing))
+        result.sort(key=lambda row: (row[2], -row[1], -row[0]))
+        return result[:limit]
+
+    def assert_matches_brute_force(self, index):
+        ingredient_ids = [ingredient.pk for ingredient in self.ingredients]
+        for _ in range(40):
+            query = self.random.sample(
+                ingredient_ids, self.random.randint(1, 8)
+            )
+            for limit in (5, 1000):
+                for max_missing in (None, 0, 2):
+                    with self.subTest(query, limit=limit,
+                                      max_missing=max_missing):
+                        self.assertEqual(
+                            index.search(query, limit, max_missing),
+                            self.brute_force(query, limit, max_missing)
+                        )
+
+    def test_after_load(self):
+        self.assert_matches_brute_force(RecipeIngredientIndex(ttl=3600))
+
+    def test_after_update_recipe(self):
+        index = RecipeIngredientIndex(ttl=3600)
+        index.search([self.ingredients[0].pk], 1)
+        recipe_ids = list(Recipe.objects.values_list('pk', flat=True))
+        changed = self.random.sample(recipe_ids, 30)
+        for pk in changed[:20]:
+            self.set_ingredients(pk, self.random)
+        Recipe.objects.filter(pk__in=changed[20:]).delete()
+        added = [3000 + i for i in range(5)]
+        for pk in added:
+            self.create_recipe(pk, self.random)
+        for pk in changed + added:
+            index.update_recipe(pk)
+        self.assert_matches_brute_force(index)
+
+
+class ShortLinkTest(TestCase):
+    """Выдача и переходы по коротким ссылкам."""
+
+    def setUp(self):
+        cache.clear()
+        short_link_cache.clear()
+        self.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='pass12345word', first_name='a', last_name='a'
+        )
+
+    def create_recipe(self, pk):
+        return Recipe.objects.create(
+            pk=pk, author=self.author, name=f'Рецепт {pk}',
+            image='recipes/test.png', text='Описание', cooking_time=1
+        )
+
+    @override_settings(SHORT_LINK_SHARED_CACHE='default')
+    def test_resolution_is_cached(self):
+        recipe = self.create_recipe(1)
+        url = f'/s/{recipe.short_link}/'
+        for queries, clear_local in ((1, False), (0, False), (0, True)):
+            with self.subTest(queries=queries, clear_local=clear_local):
+                if clear_local:
+                    short_link_cache.clear()
+                with self.assertNumQueries(queries):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 302)
+                self.assertEqual(
+                    response['Cache-Control'],
+                    f'public, max-age={settings.SHORT_LINK_CACHE_TTL}'
+                )
+        recipe.delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_backfill_skips_taken_codes(self):
+        for pk in (1, 2, 3):
+            self.create_recipe(pk)
+        Recipe.objects.filter(pk__in=(2, 3)).update(short_link=None)
+        Recipe.objects.filter(pk=1).update(short_link=encode_short_link(2))
+        call_command('backfill_short_links', stdout=io.StringIO())
+        self.assertEqual(
+            dict(Recipe.objects.values_list('pk', 'short_link')), {
+                1: encode_short_link(2),
+                2: fallback_short_link(2),
+                3: encode_short_link(3),
+            }
+        )
+        call_command(
+            'backfill_short_links', '--rewrite', stdout=io.StringIO()
+        )
+        self.assertEqual(
+            dict(Recipe.objects.values_list('pk', 'short_link')),
+            {pk: encode_short_link(pk) for pk in (1, 2, 3)}
+        )
+
+    def test_taken_code(self):
+        # Код, выданный рецепту 1 с другим ключом, совпал с кодом,
+        # который текущий ключ даёт рецепту 2.
+        old = self.create_recipe(1)
+        old.short_link = encode_short_link(2)
+        Recipe.objects.filter(pk=1).update(short_link=old.short_link)
+        recipe = self.create_recipe(2)
+        other = self.create_recipe(3)
+        self.assertNotEqual(recipe.short_link, old.short_link)
+        self.assertEqual(
+            Recipe.objects.get(pk=2).short_link, recipe.short_link
+        )
+        self.assertEqual(other.short_link, encode_short_link(3))
+        for item in (old, recipe, other):
+            response = self.client.get(f'/s/{item.short_link}/')
+            self.assertEqual(response.status_code, 302)
+            self.assertTrue(
+                response['Location'].endswith(f'/recipes/{item.pk}/')
+            )
+
+
+class CookieView(APIView):
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+
+    def get(self, request):
+        response = Response({'ok': True})
+        response.set_cookie('name', 'value')
+        return response
+
+
+class AsyncViewsTest(TestCase):
+    """Асинхронные представления отвечают так же, как синхронные."""
+
+    URL = '/api/ingredients/'
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        ingredient_index.invalidate()
+        Ingredient.objects.create(name='Соль', measurement_unit='г')
+        Ingredient.objects.create(name='Сахар', measurement_unit='г')
+        user = User.objects.create_user(
+            username='user', email='user@example.com',
+            password='pass12345word', first_name='a', last_name='a'
+        )
+        self.token = Token.objects.create(user=user).key
+        self.factory = AsyncRequestFactory()
+
+    def get_ingredients(self, token=None, queries=None):
+        headers = {'authorization': f'Token {token}'} if token else {}
+        sync = APIClient().get(
+            self.URL, {'name': 'с'}, **{
+                f'HTTP_{key.upper()}': value
+                for key, value in headers.items()
+            }
+        )
+        # AsyncRequestFactory.get() в Django 3.2 теряет data.
+        request = self.factory.get(f'{self.URL}?name=%D1%81', **headers)
+        with CaptureQueriesContext(connection) as captured:
+            response = async_to_sync(async_views.ingredient_list)(request)
+        if queries is not None:
+            self.assertEqual(len(captured), queries)
+        self.assertEqual(response.status_code, sync.status_code)
+        self.assertEqual(response.content, sync.content)
+        return response
+
+    def test_ingredient_list(self):
+        self.assertEqual(self.get_ingredients().status_code, 200)
+        self.assertIsNotNone(ingredient_index.peek())
+        response = self.get_ingredients(queries=0)
+        self.assertEqual(json.loads(response.content)[0]['name'], 'Сахар')
+        self.assertEqual(
+            self.get_ingredients(self.token, queries=0).status_code, 200
+        )
+        self.assertEqual(self.get_ingredients('invalid').status_code, 401)
+
+    def test_in_thread_keeps_cookies(self):
+        response = async_to_sync(async_views.in_thread(CookieView.as_view()))(
+            self.factory.get('/')
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.cookies['name'].value, 'value')
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1'], REPLICA_PIN_SECONDS=10)
+class ReplicaRoutingTest(TestCase):
+    """Чтения идут на реплику, пока пользователь ничего не менял."""
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.writer, self.reader = (
+            User.objects.create_user(
+                username=name, email=f'{name}@example.com',
+                password='pass12345word', first_name=name, last_name=name
+            )
+            for name in ('writer', 'reader')
+        )
+        self.factory = APIRequestFactory()
+
+    def read_database(self, method='get', user=None):
+        """База, из которой представление читало бы во время запроса."""
+        databases = []
+
+        def get_response(request):
+            databases.append(ReplicaRouter().db_for_read(Recipe))
+            # Пользователя request получает от DRF уже внутри представления.
+            request.user = user or AnonymousUser()
+            return HttpResponse()
+
+        headers = {}
+        if user is not None:
+            token, _ = Token.objects.get_or_create(user=user)
+            headers['HTTP_AUTHORIZATION'] = f'Token {token.key}'
+        request = getattr(self.factory, method)(RECIPES_URL, **headers)
+        ReplicaRoutingMiddleware(get_response)(request)
+        return databases[0]
+
+    def test_pin_after_write(self):
+        self.assertEqual(self.read_database(), 'replica_1')
+        self.assertEqual(self.read_database(user=self.writer), 'replica_1')
+        self.assertEqual(
+            self.read_database('post', user=self.writer), DEFAULT_DB_ALIAS
+        )
+        self.assertEqual(
+            self.read_database(user=self.writer), DEFAULT_DB_ALIAS
+        )
+        self.assertEqual(self.read_database(user=self.reader), 'replica_1')
+        self.assertEqual(self.read_database(), 'replica_1')
+        cache.clear()
+        self.assertEqual(self.read_database(user=self.writer), 'replica_1')
+
+    def test_async(self):
+        databases = []
+
+        async def get_response(request):
+            databases.append(ReplicaRouter().db_for_read(Recipe))
+            return HttpResponse()
+
+        pin_to_primary(self.writer.pk)
+        middleware = ReplicaRoutingMiddleware(get_response)
+        for user in (self.writer, self.reader):
+            token = Token.objects.create(user=user)
+            async_to_sync(middleware)(AsyncRequestFactory().get(
+                RECIPES_URL, authorization=f'Token {token.key}'
+            ))
+        self.assertEqual(databases, [DEFAULT_DB_ALIAS, 'replica_1'])
+
+    def test_outside_requests(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Recipe), DEFAULT_DB_ALIAS)
+        self.assertEqual(router.db_for_write(Recipe), DEFAULT_DB_ALIAS)
+        self.assertFalse(router.allow_migrate('replica_1', 'recipes'))
+        self.assertTrue(router.allow_migrate(DEFAULT_DB_ALIAS, 'recipes'))
+        with override_settings(DATABASE_REPLICAS=[]):
+            with self.assertRaises(MiddlewareNotUsed):
+                ReplicaRoutingMiddleware(HttpResponse)
+
+
+class Base64JSONParserTest(SimpleTestCase):
+    """Потоковый разбор data URI не зависит от границ кусков."""
+
+    # В base64 этих байтов есть и «+», и «/».
+    CONTENT = bytes(range(256)) * 3
+    CHUNK_SIZES = (1, 2, 3, 64 * 1024)
+
+    def parse(self, body, chunk_size):
+        parser = Base64JSONParser()
+        parser.chunk_size = chunk_size
+        return parser.parse(io.BytesIO(body))
+
+    def data_uri(self):
+        encoded = base64.b64encode(self.CONTENT).decode()
+        return 'data:image\\/png;base64,' + encoded.replace('/', '\\/')
+
+    def test_files_and_strings(self):
+        strings = {
+            'name': 'Кавычки " и \\ слэш data:image/png;base64,QUJD',
+            'text': 'data:image/png;base64,QUJD',
+            'tags': [1, 'data:image/png;base64,QUJD'],
+        }
+        body = json.dumps(strings, ensure_ascii=False)[:-1] + (
+            f', "image": "{self.data_uri()}",'
+            f' "nested": {{"avatar" : "{self.data_uri()}"}}}}'
+        )
+        for chunk_size in self.CHUNK_SIZES:
+            with self.subTest(chunk_size=chunk_size):
+                data = self.parse(body.encode(), chunk_size)
+                for key, file in (
+                    ('image', data.pop('image')),
+                    ('avatar', data.pop('nested')['avatar']),
+                ):
+                    self.assertEqual(file.content_type, 'image/png', key)
+                    self.assertEqual(file.size, len(self.CONTENT), key)
+                    self.assertEqual(file.read(), self.CONTENT, key)
+                self.assertEqual(data, strings)
+
+    def test_invalid_base64(self):
+        for body in (
+            b'{"image": "data:image/png;base64,QUJ*"}',
+            b'{"image": "data:image/png;base64,QUJDR"}',
+            b'{"image": "data:image/png;base64,QUJDRA"}',
+            b'{"image": "data:image/png;base64,QUJD',
+        ):
+            for chunk_size in self.CHUNK_SIZES:
+                with self.subTest(body, chunk_size=chunk_size):
+                    with self.assertRaises(ParseError):
+                        self.parse(body, chunk_size)
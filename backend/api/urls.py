@@ -3,7 +3,9 @@ from django.conf.urls.static import static
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import IngredientViewSet, RecipeViewSet, TagViewSet, UserViewSet
+from . import async_views
+from .views import (IngredientViewSet, MetricsView, RecipeViewSet, TagViewSet,
+                    UserViewSet)
 
 app_name = 'api'
 
@@ -14,7 +16,18 @@ router_v1.register('tags', TagViewSet, basename='tags')
 router_v1.register('recipes', RecipeViewSet, basename='recipes')
 router_v1.register('ingredients', IngredientViewSet, basename='ingredients')
 
-urlpatterns = [
+urlpatterns = []
+
+if settings.ASYNC_VIEWS:
+    urlpatterns += [
+        path(
+            'ingredients/',
+            async_views.ingredient_list,
+            name='ingredients-list'
+        ),
+    ]
+
+urlpatterns += [
     path(
         '',
         include(router_v1.urls)
@@ -27,6 +40,11 @@ urlpatterns = [
         'auth/',
         include('djoser.urls.authtoken')
     ),
+    path(
+        'metrics/',
+        MetricsView.as_view(),
+        name='metrics'
+    ),
     path(
         'recipes/<int:pk>/get-link/',
         RecipeViewSet.as_view({'get': 'get_link'}),
@@ -1,35 +1,139 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import (BooleanField, OuterRef, Prefetch, Subquery, Sum,
+                              Value)
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from recipes.models import (Favorites, Ingredient, Recipe, ShoppingCart,
                             Subscriptions, Tag, User)
 from rest_framework import status
+from rest_framework.authentication import SessionAuthentication
 from rest_framework.decorators import action
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
-from .filters import IngredientFilter, RecipeFilter
-from .pagination import Pagination
+from .authentication import CachedTokenAuthentication
+from .cache import (bump_shopping_cart_version, cache_shopping_list,
+                    get_feed_head, get_feed_version, get_shopping_cart_version,
+                    get_shopping_list, resolve_short_link, set_feed_head)
+from .filters import (DEFAULT_RECIPE_ORDERING, RECIPE_ORDERINGS, RecipeFilter,
+                      get_recipe_ordering)
+from .ingredient_index import ingredient_index
+from .metrics import registry
+from .middleware import timed_serialization
+from .pagination import KeysetPagination, Pagination
+from .parsers import Base64JSONParser
 from .permissions import IsAuthorOrReadOnly
+from .recipe_index import recipe_ingredient_index
+from .reference import ingredient_list, tag_list
+from .renderers import (CSVShoppingListRenderer, PDFShoppingListRenderer,
+                        ShoppingListNegotiation, ShoppingListRenderer,
+                        TextShoppingListRenderer)
+from .row_serializers import RecipeRowSerializer
 from .serializers import (FavoritesSerializer, IngredientSerializer,
                           RecipeCreateSerializer, RecipeSerializer,
                           ShoppingCartSerializer, SubscriptionsSerializer,
                           TagSerializer, UserAvatarSerializer, UserSerializer,
-                          UserSubscriptionSerializer)
+                          UserSubscriptionSerializer, get_recipes_limit)
+
+
+def get_ingredient_search_limit(query_params):
+    try:
+        return min(
+            int(query_params['limit']), settings.INGREDIENT_SEARCH_LIMIT
+        )
+    except (KeyError, ValueError):
+        return settings.INGREDIENT_SEARCH_LIMIT
 
 
 class RecipeViewSet(ModelViewSet):
     queryset = Recipe.objects.all()
     pagination_class = Pagination
+    parser_classes = (Base64JSONParser, MultiPartParser)
     permission_classes = (IsAuthorOrReadOnly,)
     serializer_class = RecipeSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    @property
+    def cursor_ordering(self):
+        if self.action == 'feed':
+            return RECIPE_ORDERINGS['new']
+        return get_recipe_ordering(self.request)
+
+    def get_queryset(self):
+        if self.action in ('list', 'retrieve'):
+            return Recipe.objects.with_user_flags(self.request.user).order_by(
+                *RECIPE_ORDERINGS[DEFAULT_RECIPE_ORDERING]
+            )
+        return super().get_queryset()
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['recipe_image_size'] = (
+            'card' if self.action in ('list', 'feed', 'what_to_cook')
+            else 'detail'
+        )
+        return context
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if (isinstance(response, Response)
+                and issubclass(self.renderer_classes[0],
+                               ShoppingListRenderer)):
+            # Файл списка покупок отдаётся StreamingHttpResponse,
+            # а ошибки — в JSON, какой бы формат ни выбрал клиент.
+            request.accepted_renderer = JSONRenderer()
+            request.accepted_media_type = JSONRenderer.media_type
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def get_recipe_rows(self, queryset):
+        cursor_fields = (field.lstrip('-') for field in self.cursor_ordering)
+        return RecipeRowSerializer.get_rows(
+            queryset, self.request.user, *cursor_fields
+        )
+
+    def get_row_serializer(self):
+        return RecipeRowSerializer(context=self.get_serializer_context())
+
+    def list(self, request, *args, **kwargs):
+        rows = self.get_recipe_rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response(self.get_row_serializer().serialize(rows))
+        return self.get_paginated_response(
+            self.get_row_serializer().serialize(page)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            rows = self.get_recipe_rows(
+                self.filter_queryset(self.get_queryset()).filter(
+                    **{self.lookup_field: kwargs[lookup_url_kwarg]}
+                )
+            )
+        except (TypeError, ValueError, DjangoValidationError):
+            raise Http404
+        data = self.get_row_serializer().serialize(rows)
+        if not data:
+            raise Http404
+        return Response(data[0])
+
+    def perform_destroy(self, instance):
+        bump_shopping_cart_version(*instance.shopping_cart.values_list(
+            'user_id', flat=True
+        ))
+        super().perform_destroy(instance)
+
     def get_serializer_class(self):
         """Выбираем сериализатор в зависимости от действия."""
         if self.action in ['create', 'update', 'partial_update']:
@@ -68,6 +172,7 @@ class RecipeViewSet(ModelViewSet):
         )
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        bump_shopping_cart_version(request.user.id)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @shopping_cart.mapping.delete
@@ -78,31 +183,130 @@ class RecipeViewSet(ModelViewSet):
         ).delete()
         if not deleted_count:
             return Response(status=status.HTTP_400_BAD_REQUEST)
+        bump_shopping_cart_version(request.user.id)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=False,
             methods=['get'],
-            permission_classes=[IsAuthenticated])
+            permission_classes=[IsAuthenticated],
+            renderer_classes=(TextShoppingListRenderer,
+                              CSVShoppingListRenderer,
+                              PDFShoppingListRenderer),
+            content_negotiation_class=ShoppingListNegotiation)
     def download_shopping_cart(self, request):
         user = request.user
-        if not user.shopping_cart.exists():
-            return Response(status=status.HTTP_400_BAD_REQUEST)
-        ingredients = Ingredient.objects.filter(
-            recipe__recipe__shopping_cart__user=user).values(
-            'name',
-            'measurement_unit').annotate(amount=Sum('recipe__amount'))
-        shopping_list = ['Список покупок.']
-        for ingredient in ingredients:
-            shopping_list += [
-                f'{ingredient["name"]}'
-                f'({ingredient["measurement_unit"]}):'
-                f'{ingredient["amount"]}']
-        filename = f'{user.username}_shopping_list.txt'
-        result_list = '\n'.join(shopping_list)
-        response = HttpResponse(result_list, content_type='text/plain')
+        renderer = request.accepted_renderer
+        version = get_shopping_cart_version(user.id)
+        etag = quote_etag(f'{version}-{renderer.format}')
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        ingredients = get_shopping_list(user.id, version)
+        if ingredients is None:
+            if not user.shopping_cart.exists():
+                return Response(status=status.HTTP_400_BAD_REQUEST)
+            ingredients = cache_shopping_list(
+                user.id,
+                version,
+                Ingredient.objects.filter(
+                    recipe__recipe__shopping_cart__user=user).values(
+                    'name',
+                    'measurement_unit').annotate(
+                    amount=Sum('recipe__amount')).order_by('name').iterator()
+            )
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients),
+            content_type=renderer.get_content_type()
+        )
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        filename = f'{user.username}_shopping_list.{renderer.format}'
         response['Content-Disposition'] = f'attachment; filename={filename}'
         return response
 
+    @action(detail=False,
+            methods=['get'],
+            permission_classes=[IsAuthenticated])
+    def feed(self, request):
+        """Рецепты авторов из подписок пользователя, новые сверху.
+
+        Начало ленты кешируется списком id до публикации или удаления
+        рецепта кем-то из авторов или до изменения подписок.
+        """
+        user = request.user
+        feed = Recipe.objects.filter(author__in=Subscriptions.objects.filter(
+            user=user
+        ).values('author')).order_by(*self.cursor_ordering)
+        paginator = KeysetPagination()
+        if (paginator.cursor_query_param not in request.query_params
+                and 'count' not in request.query_params):
+            page_size = paginator.get_page_size(request)
+            version = get_feed_version(user.id)
+            recipe_ids = get_feed_head(user.id, version, page_size)
+            if recipe_ids is None:
+                recipe_ids = list(
+                    feed.values_list('pk', flat=True)[:page_size + 1]
+                )
+                set_feed_head(user.id, version, page_size, recipe_ids)
+            feed = Recipe.objects.filter(pk__in=recipe_ids).order_by(
+                *self.cursor_ordering
+            )
+        page = paginator.paginate_queryset(
+            self.get_recipe_rows(feed.with_user_flags(user)),
+            request, view=self
+        )
+        return paginator.get_paginated_response(
+            self.get_row_serializer().serialize(page)
+        )
+
+    @action(detail=False, methods=['get'])
+    def what_to_cook(self, request):
+        """Рецепты, для которых из ?ingredients= не хватает меньше всего."""
+        try:
+            ingredient_ids = [
+                int(pk) for pk in request.query_params.getlist('ingredients')
+            ]
+            max_missing = request.query_params.get('max_missing')
+            max_missing = None if max_missing is None else int(max_missing)
+        except ValueError:
+            raise ValidationError(
+                'ingredients и max_missing должны быть целыми числами.'
+            )
+        if not ingredient_ids:
+            raise ValidationError(
+                {'ingredients': 'Укажите хотя бы один ингредиент.'}
+            )
+        try:
+            limit = min(
+                int(request.query_params['limit']),
+                settings.WHAT_TO_COOK_LIMIT
+            )
+        except (KeyError, ValueError):
+            limit = settings.REST_FRAMEWORK['PAGE_SIZE']
+        matches = recipe_ingredient_index.search(
+            ingredient_ids, limit, max_missing
+        )
+        recipes = {
+            recipe['id']: recipe
+            for recipe in self.get_row_serializer().serialize(
+                RecipeRowSerializer.get_rows(
+                    Recipe.objects.with_user_flags(request.user).filter(
+                        pk__in=[recipe_id for recipe_id, _, _ in matches]
+                    ),
+                    request.user
+                )
+            )
+        }
+        result = []
+        for recipe_id, matched, missing in matches:
+            if recipe_id not in recipes:
+                continue
+            data = recipes[recipe_id]
+            data['matched_ingredients'] = matched
+            data['missing_ingredients'] = missing
+            result.append(data)
+        return Response(result)
+
     @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated])
     def get_link(self, request, pk):
         recipe = self.get_object()
@@ -113,17 +317,35 @@ class RecipeViewSet(ModelViewSet):
 
 
 class ShortLinkViewSet(APIView):
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+
     def get(self, request, short_code):
-        try:
-            recipe = Recipe.objects.get(short_link=short_code)
-            return redirect(
-                request.build_absolute_uri(f'/recipes/{recipe.id}/')
-            )
-        except Recipe.DoesNotExist:
+        recipe_id = resolve_short_link(short_code)
+        if recipe_id is None:
             return Response(
                 {'error': 'Рецепта с таким коротким кодом не существует.'},
                 status=404
             )
+        response = redirect(
+            request.build_absolute_uri(f'/recipes/{recipe_id}/')
+        )
+        patch_cache_control(
+            response, public=True, max_age=settings.SHORT_LINK_CACHE_TTL
+        )
+        return response
+
+
+class MetricsView(APIView):
+    authentication_classes = (
+        SessionAuthentication, CachedTokenAuthentication
+    )
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return HttpResponse(
+            registry.render(), content_type='text/plain; version=0.0.4'
+        )
 
 
 class TagViewSet(ReadOnlyModelViewSet):
@@ -131,19 +353,33 @@ class TagViewSet(ReadOnlyModelViewSet):
     serializer_class = TagSerializer
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+        return tag_list.response(request)
+
 
 class IngredientViewSet(ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
-    filter_backends = (DjangoFilterBackend,)
-    filterset_class = IngredientFilter
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if not name:
+            if request.accepted_renderer.format != 'json':
+                return Response(ingredient_index.all())
+            return ingredient_list.response(request)
+        return Response(ingredient_index.search(
+            name, get_ingredient_search_limit(request.query_params)
+        ))
+
 
 class UserViewSet(UserViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     pagination_class = Pagination
+    cursor_ordering = ('id',)
     filter_backends = (DjangoFilterBackend,)
     permission_classes = [AllowAny]
 
@@ -185,17 +421,32 @@ class UserViewSet(UserViewSet):
             methods=['get'])
     def subscriptions(self, request):
         user = request.user
-        subscribers = User.objects.filter(subscribers__user=user)
+        recipes = Recipe.objects.all()
+        recipes_limit = get_recipes_limit(request)
+        if recipes_limit:
+            recipes = recipes.filter(pk__in=Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef('author')
+                ).values('pk')[:recipes_limit]
+            ))
+        subscribers = User.objects.filter(subscribers__user=user).annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+        ).prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='recipes_preview')
+        ).order_by('username')
         pages = self.paginate_queryset(subscribers)
         serializer = UserSubscriptionSerializer(
             pages,
             many=True,
             context={'request': request}
         )
-        return self.get_paginated_response(serializer.data)
+        with timed_serialization():
+            data = serializer.data
+        return self.get_paginated_response(data)
 
     @action(methods=['put'], detail=False, url_path='me/avatar',
-            permission_classes=[IsAuthenticated])
+            permission_classes=[IsAuthenticated],
+            parser_classes=[Base64JSONParser, MultiPartParser])
     def manage_avatar(self, request):
         user = self.request.user
         serializer = UserAvatarSerializer(
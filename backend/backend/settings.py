@@ -9,8 +9,16 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = os.getenv('SECRET_KEY')
 
+# Ключ перестановки коротких ссылок. Не зависит от SECRET_KEY, чтобы
+# смена секрета не меняла коды новых рецептов.
+SHORT_LINK_KEY = os.getenv('SHORT_LINK_KEY', '')
+
 DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
 
+# Асинхронные представления самых нагруженных эндпоинтов (api.async_views)
+# вместо синхронных. Включать при запуске под ASGI (uvicorn).
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False').lower() == 'true'
+
 ALLOWED_HOSTS = os.getenv('ALLOWED_HOSTS').split(',')
 
 INSTALLED_APPS = [
@@ -28,11 +36,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.QueryMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -76,6 +86,64 @@ else:
         }
     }
 
+# Реплики только для чтения, через запятую: файлы SQLite или хосты
+# PostgreSQL (host[:port]) с теми же базой и учётными данными.
+DATABASE_REPLICAS = []
+for number, location in enumerate(
+    filter(None, os.getenv('DB_REPLICAS', '').split(',')), 1
+):
+    replica = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+    if replica['ENGINE'].endswith('sqlite3'):
+        replica['NAME'] = location.strip()
+    else:
+        host, _, port = location.strip().partition(':')
+        replica.update(HOST=host, PORT=port or replica['PORT'])
+    DATABASES[f'replica_{number}'] = replica
+    DATABASE_REPLICAS.append(f'replica_{number}')
+
+DATABASE_ROUTERS = ['api.db_router.ReplicaRouter'] if DATABASE_REPLICAS else []
+
+# Сколько секунд после изменения пользователь читает основную базу.
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 10))
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+SHOPPING_LIST_CACHE_TIMEOUT = int(
+    os.getenv('SHOPPING_LIST_CACHE_TIMEOUT', 60 * 60 * 24)
+)
+
+FEED_CACHE_TIMEOUT = int(os.getenv('FEED_CACHE_TIMEOUT', 300))
+
+SHORT_LINK_CACHE_SIZE = int(os.getenv('SHORT_LINK_CACHE_SIZE', 10000))
+SHORT_LINK_CACHE_TTL = int(os.getenv('SHORT_LINK_CACHE_TTL', 300))
+SHORT_LINK_SHARED_CACHE = os.getenv('SHORT_LINK_SHARED_CACHE')
+
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', 10))
+TOKEN_SHARED_CACHE = os.getenv('TOKEN_SHARED_CACHE')
+
+INGREDIENT_INDEX_TTL = int(os.getenv('INGREDIENT_INDEX_TTL', 300))
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 50))
+REFERENCE_CACHE_MAX_AGE = int(os.getenv('REFERENCE_CACHE_MAX_AGE', 60))
+REFERENCE_CHECK_INTERVAL = int(os.getenv('REFERENCE_CHECK_INTERVAL', 5))
+REFERENCE_TTL = int(os.getenv('REFERENCE_TTL', 300))
+
+RECIPE_INDEX_TTL = int(os.getenv('RECIPE_INDEX_TTL', 300))
+WHAT_TO_COOK_LIMIT = int(os.getenv('WHAT_TO_COOK_LIMIT', 50))
+
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', 500))
+SLOW_REQUEST_QUERIES = int(os.getenv('SLOW_REQUEST_QUERIES', 50))
+
+POPULARITY_HALF_LIFE_DAYS = float(os.getenv('POPULARITY_HALF_LIFE_DAYS', 7))
+POPULARITY_WINDOW_DAYS = int(os.getenv('POPULARITY_WINDOW_DAYS', 60))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -111,7 +179,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication'
+        'api.authentication.CachedTokenAuthentication'
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 6,
@@ -128,6 +196,12 @@ USE_L10N = True
 
 USE_TZ = True
 
+IMAGE_QUEUE_DIR = os.getenv('IMAGE_QUEUE_DIR', BASE_DIR / 'image_queue')
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+# Формат уменьшенных копий: webp или jpeg. После смены запустить
+# manage.py process_images --reset, чтобы перегенерировать копии.
+IMAGE_DERIVATIVE_FORMAT = os.getenv('IMAGE_DERIVATIVE_FORMAT', 'webp')
+
 STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / 'collected_static'
 
@@ -1,4 +1,6 @@
+from api import async_views
 from api.views import ShortLinkViewSet
+from django.conf import settings
 from django.contrib import admin
 from django.urls import include, path
 
@@ -13,7 +15,8 @@ urlpatterns = [
     ),
     path(
         's/<str:short_code>/',
-        ShortLinkViewSet.as_view(),
+        async_views.short_link if settings.ASYNC_VIEWS
+        else ShortLinkViewSet.as_view(),
         name='short_link'
     ),
 ]
@@ -19,7 +19,8 @@ class RecipeTagInline(admin.TabularInline):
 
 
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author',)
+    list_display = ('name', 'author', 'favorites_count', 'in_carts_count',
+                    'popularity',)
     list_filter = ('author', 'name', 'tags__name',)
     inlines = [RecipeIngredientInline, RecipeTagInline]
 
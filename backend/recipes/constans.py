@@ -6,3 +6,18 @@ MIN_VALUE_VALIDATOR = 1
 MAX_VALUE_VALIDATOR = 32000
 RECIPE_LENGTH = 256
 SHORT_LINK_LENGTH = 50
+SHORT_LINK_ALPHABET = (
+    '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+)
+SHORT_CODE_LENGTH = 5
+# Производные изображения: название размера -> (ширина, высота, обрезка).
+IMAGE_SIZES = {
+    'card': (600, 400, False),
+    'detail': (1200, 800, False),
+    'avatar': (200, 200, True),
+}
+RECIPE_IMAGE_SIZES = ('card', 'detail')
+AVATAR_IMAGE_SIZES = ('avatar',)
+
+FAVORITE_POPULARITY_WEIGHT = 1.0
+SHOPPING_CART_POPULARITY_WEIGHT = 0.5
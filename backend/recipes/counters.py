@@ -0,0 +1,47 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Favorites, Recipe, ShoppingCart, Subscriptions, User
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorites, 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'subscribers_count', Subscriptions, 'author'),
+)
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно меняет счётчик прямо в базе, не опуская его ниже нуля."""
+    model.objects.filter(pk=pk).update(
+        **{field: Greatest(F(field) + delta, 0)}
+    )
+
+
+def actual_count(source, relation):
+    return Coalesce(Subquery(
+        source.objects.filter(**{relation: OuterRef('pk')}).order_by()
+        .values(relation).annotate(count=Count('pk')).values('count')
+    ), 0)
+
+
+def reconcile_counters(dry_run=False):
+    """Пересчитывает счётчики по связанным таблицам.
+
+    На каждый счётчик уходит один UPDATE, который трогает только
+    разошедшиеся строки. Возвращает их число по каждому счётчику.
+    """
+    result = {}
+    for model, field, source, relation in COUNTERS:
+        actual = actual_count(source, relation)
+        stale = model.objects.annotate(actual=actual).exclude(
+            **{field: F('actual')}
+        ).order_by()
+        label = f'{model.__name__}.{field}'
+        if dry_run:
+            result[label] = stale.count()
+        else:
+            result[label] = model.objects.filter(
+                pk__in=stale.values('pk')
+            ).update(**{field: actual})
+    return result
@@ -0,0 +1,169 @@
+import io
+import json
+import logging
+import os
+import posixpath
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from .constans import IMAGE_SIZES
+from .models import Recipe, User
+
+logger = logging.getLogger(__name__)
+
+PILLOW_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+PROCESSING_SUFFIX = '.processing'
+FAILED_SUFFIX = '.failed'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def derivative_name(name, size):
+    """Путь производного изображения рядом с оригиналом."""
+    image_format = settings.IMAGE_DERIVATIVE_FORMAT
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(
+        directory, 'derivatives', f'{stem}_{size}.{image_format}'
+    )
+
+
+def derivative_url(file, size):
+    """URL уменьшенной копии, а пока её нет — URL оригинала."""
+    return storage_derivative_url(
+        file.storage, file.name, size,
+        getattr(file.instance, f'{file.field.name}_derivatives', '')
+    )
+
+
+def storage_derivative_url(storage, name, size, ready):
+    """То же, что derivative_url, по имени файла без FieldFile.
+
+    ready — значение поля <поле>_derivatives: имя файла, для которого
+    копии уже сгенерированы. Хранилище не опрашивается.
+    """
+    if ready and ready == name:
+        return storage.url(derivative_name(name, size))
+    return storage.url(name)
+
+
+def mark_ready(name):
+    """Отмечает в базе, что у файла name есть уменьшенные копии."""
+    for model, field in ((Recipe, 'image'), (User, 'avatar')):
+        model.objects.filter(**{field: name}).update(
+            **{f'{field}_derivatives': name}
+        )
+
+
+def _queue_dir():
+    path = Path(settings.IMAGE_QUEUE_DIR)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def enqueue(name, sizes):
+    """Кладёт задачу в очередь на диске и будит пул обработчиков."""
+    queue_dir = _queue_dir()
+    task = queue_dir / f'{time.time_ns()}-{uuid.uuid4().hex}.json'
+    temporary = task.with_suffix('.tmp')
+    temporary.write_text(json.dumps({'name': name, 'sizes': list(sizes)}))
+    os.replace(temporary, task)
+    if settings.IMAGE_WORKERS:
+        _get_executor().submit(process_queue)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_WORKERS,
+                thread_name_prefix='images'
+            )
+        return _executor
+
+
+def _render(image, size, image_format):
+    width, height, crop = IMAGE_SIZES[size]
+    if crop:
+        image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+    else:
+        image = image.copy()
+        image.thumbnail((width, height), Image.LANCZOS)
+    if image_format == 'jpeg' or image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, PILLOW_FORMATS[image_format], quality=82)
+    return buffer.getvalue()
+
+
+def generate_derivatives(name, sizes, storage=default_storage):
+    with storage.open(name, 'rb') as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image.load()
+    for size in sizes:
+        target = derivative_name(name, size)
+        content = _render(image, size, settings.IMAGE_DERIVATIVE_FORMAT)
+        if storage.exists(target):
+            storage.delete(target)
+        storage.save(target, ContentFile(content))
+
+
+def claim_task():
+    """Забирает задачу атомарным переименованием: её получит один
+    обработчик, даже если очередь разбирают несколько процессов."""
+    for task in sorted(_queue_dir().glob('*.json')):
+        claimed = task.with_name(task.name + PROCESSING_SUFFIX)
+        try:
+            os.rename(task, claimed)
+        except FileNotFoundError:
+            continue
+        claimed.touch()
+        return claimed
+    return None
+
+
+def process_task(claimed):
+    task = json.loads(claimed.read_text())
+    try:
+        generate_derivatives(task['name'], task['sizes'])
+        mark_ready(task['name'])
+    except Exception:
+        logger.exception('Не удалось обработать %s', task['name'])
+        os.replace(claimed, claimed.with_name(
+            claimed.name[:-len(PROCESSING_SUFFIX)] + FAILED_SUFFIX
+        ))
+        return False
+    claimed.unlink()
+    return True
+
+
+def process_queue():
+    processed = 0
+    while True:
+        claimed = claim_task()
+        if claimed is None:
+            return processed
+        processed += process_task(claimed)
+
+
+def requeue_stale(max_age):
+    """Возвращает в очередь задачи, зависшие после падения обработчика."""
+    deadline = time.time() - max_age
+    requeued = 0
+    for claimed in _queue_dir().glob('*' + PROCESSING_SUFFIX):
+        if claimed.stat().st_mtime < deadline:
+            os.replace(claimed, claimed.with_name(
+                claimed.name[:-len(PROCESSING_SUFFIX)]
+            ))
+            requeued += 1
+    return requeued
@@ -0,0 +1,116 @@
+import csv
+import json
+import re
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes.signals import bulk_loaded
+
+JSON_SEPARATORS = re.compile(r'[\s,]*')
+
+
+def iter_json_array(file, chunk_size=64 * 1024):
+    """Читает JSON-массив объектов по частям, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = file.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Ожидается JSON-массив.')
+    position = 1
+    while True:
+        position = JSON_SEPARATORS.match(buffer, position).end()
+        if buffer.startswith(']', position):
+            return
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                raise CommandError('Некорректный или оборванный JSON.')
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield item
+
+
+class BulkLoadCommand(BaseCommand):
+    """Загрузка справочника из JSON, JSON Lines или CSV через bulk_create.
+
+    Строки, уже существующие в базе или повторяющиеся в файле,
+    отбрасываются по полям unique_fields ещё до вставки.
+    """
+
+    model = None
+    fields = ()
+    unique_fields = ()
+    default_path = None
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=self.default_path,
+            help='Файл .json, .jsonl или .csv (CSV без заголовка).'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def read_rows(self, path):
+        suffix = path.suffix.lower()
+        with path.open(encoding='utf-8', newline='') as file:
+            if suffix == '.csv':
+                for row in csv.reader(file):
+                    if row:
+                        yield dict(zip(self.fields, row))
+            elif suffix == '.jsonl':
+                for line in file:
+                    if line.strip():
+                        yield json.loads(line)
+            elif suffix == '.json':
+                yield from iter_json_array(file)
+            else:
+                raise CommandError(f'Неизвестный формат файла: {path}')
+
+    def get_key(self, values):
+        return tuple(values[field] for field in self.unique_fields)
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'Файл {path} не найден.')
+        batch_size = options['batch_size']
+        started = time.monotonic()
+        seen = set(
+            self.model.objects.values_list(*self.unique_fields)
+        )
+        total = 0
+        batch = []
+        with transaction.atomic():
+            # bulk_create с ignore_conflicts не сообщает, сколько строк
+            # пропустил, поэтому добавленные считаются по таблице.
+            before = self.model.objects.count()
+            for row in self.read_rows(path):
+                total += 1
+                values = {
+                    field: str(row[field]).strip() for field in self.fields
+                }
+                key = self.get_key(values)
+                if key in seen:
+                    continue
+                seen.add(key)
+                batch.append(self.model(**values))
+                if len(batch) >= batch_size:
+                    self.model.objects.bulk_create(
+                        batch, ignore_conflicts=True
+                    )
+                    batch = []
+            self.model.objects.bulk_create(batch, ignore_conflicts=True)
+            created = self.model.objects.count() - before
+            if created:
+                transaction.on_commit(
+                    lambda: bulk_loaded.send(sender=self.model)
+                )
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{self.model._meta.verbose_name_plural}: '
+            f'добавлено {created} из {total} строк '
+            f'за {elapsed:.2f} с ({total / max(elapsed, 1e-6):.0f} строк/с).'
+        ))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from recipes.models import Recipe
+from recipes.short_links import encode_short_link, fallback_short_link
+
+
+class Command(BaseCommand):
+    help = 'Проставляет короткие ссылки рецептам, у которых их нет.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rewrite', action='store_true',
+            help='Пересчитать и старые случайные коды. Ранее '
+                 'опубликованные ссылки перестанут работать.'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.order_by('pk')
+        empty = Q(short_link__isnull=True) | Q(short_link='')
+        updated = 0
+        batch = []
+        with transaction.atomic():
+            if options['rewrite']:
+                # Иначе новый код может совпасть со старым кодом рецепта,
+                # до которого очередь ещё не дошла.
+                recipes.update(short_link=None)
+                taken = set()
+            else:
+                recipes = recipes.filter(empty)
+                taken = set(Recipe.objects.exclude(empty).values_list(
+                    'short_link', flat=True
+                ))
+            for recipe in recipes.only('pk').iterator():
+                recipe.short_link = encode_short_link(recipe.pk)
+                if recipe.short_link in taken:
+                    recipe.short_link = fallback_short_link(recipe.pk)
+                batch.append(recipe)
+                if len(batch) >= options['batch_size']:
+                    Recipe.objects.bulk_update(batch, ['short_link'])
+                    updated += len(batch)
+                    batch = []
+            Recipe.objects.bulk_update(batch, ['short_link'])
+            updated += len(batch)
+        self.stdout.write(self.style.SUCCESS(
+            f'Обновлено коротких ссылок: {updated}.'
+        ))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from recipes.popularity import update_popularity
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает популярность рецептов по избранному и спискам '
+        'покупок. Запускается по расписанию или с --loop.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Не завершаться, а пересчитывать каждые --interval с.'
+        )
+        parser.add_argument('--interval', type=float, default=3600)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        while True:
+            updated = update_popularity(options['batch_size'])
+            self.stdout.write(
+                f'Рецептов с ненулевой популярностью: {updated}.'
+            )
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
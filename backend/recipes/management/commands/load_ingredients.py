@@ -0,0 +1,10 @@
+from recipes.management.bulk_load import BulkLoadCommand
+from recipes.models import Ingredient
+
+
+class Command(BulkLoadCommand):
+    help = 'Загружает ингредиенты из JSON, JSON Lines или CSV.'
+    model = Ingredient
+    fields = ('name', 'measurement_unit')
+    unique_fields = ('name', 'measurement_unit')
+    default_path = 'data/ingredients.json'
@@ -0,0 +1,10 @@
+from recipes.management.bulk_load import BulkLoadCommand
+from recipes.models import Tag
+
+
+class Command(BulkLoadCommand):
+    help = 'Загружает теги из JSON, JSON Lines или CSV.'
+    model = Tag
+    fields = ('name', 'slug')
+    unique_fields = ('slug',)
+    default_path = 'data/tags.json'
@@ -0,0 +1,75 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import F
+from recipes.constans import AVATAR_IMAGE_SIZES, RECIPE_IMAGE_SIZES
+from recipes.images import (derivative_name, enqueue, mark_ready,
+                            process_queue, requeue_stale)
+from recipes.models import Recipe, User
+
+
+class Command(BaseCommand):
+    help = 'Разбирает очередь генерации уменьшенных изображений.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--missing', action='store_true',
+            help='Поставить в очередь изображения без уменьшенных копий.'
+        )
+        parser.add_argument(
+            '--reset', action='store_true',
+            help='Сбросить отметки о готовых копиях и проверить их заново, '
+                 'например после смены формата.'
+        )
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Не завершаться, а проверять очередь каждые --interval с.'
+        )
+        parser.add_argument('--interval', type=float, default=2)
+        parser.add_argument(
+            '--stale', type=int, default=600,
+            help='Через сколько секунд считать задачу в работе зависшей.'
+        )
+
+    @staticmethod
+    def reset():
+        Recipe.objects.update(image_derivatives='')
+        User.objects.update(avatar_derivatives='')
+
+    def enqueue_missing(self):
+        queued = 0
+        recipes = Recipe.objects.exclude(image='').exclude(
+            image_derivatives=F('image')
+        )
+        users = User.objects.exclude(avatar='').exclude(
+            avatar__isnull=True
+        ).exclude(avatar_derivatives=F('avatar'))
+        sources = (
+            (recipes, 'image', RECIPE_IMAGE_SIZES),
+            (users, 'avatar', AVATAR_IMAGE_SIZES),
+        )
+        storage = Recipe.image.field.storage
+        for queryset, field, sizes in sources:
+            names = queryset.order_by().values_list(field, flat=True)
+            for name in names.distinct().iterator():
+                # Копии могли сгенерировать до появления отметки в базе.
+                if storage.exists(derivative_name(name, sizes[0])):
+                    mark_ready(name)
+                else:
+                    enqueue(name, sizes)
+                    queued += 1
+        return queued
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            self.reset()
+        if options['missing'] or options['reset']:
+            self.stdout.write(f'В очередь: {self.enqueue_missing()}.')
+        while True:
+            requeue_stale(options['stale'])
+            processed = process_queue()
+            if processed:
+                self.stdout.write(f'Обработано изображений: {processed}.')
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from recipes.models import Recipe
+from recipes.search import FTS_TABLE, index_recipes
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает поисковый индекс всех рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        recipe_ids = list(
+            Recipe.objects.order_by('pk').values_list('pk', flat=True)
+        )
+        batch_size = options['batch_size']
+        with transaction.atomic():
+            if connection.vendor == 'sqlite':
+                with connection.cursor() as cursor:
+                    cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            for start in range(0, len(recipe_ids), batch_size):
+                index_recipes(recipe_ids[start:start + batch_size])
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано рецептов: {len(recipe_ids)}.'
+        ))
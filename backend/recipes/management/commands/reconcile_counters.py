@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.counters import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает денормализованные счётчики избранного, корзин, '
+        'рецептов и подписчиков по исходным таблицам.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, сколько строк разошлось.'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            result = reconcile_counters(dry_run=options['dry_run'])
+        verb = 'Разошлось' if options['dry_run'] else 'Исправлено'
+        for label, count in result.items():
+            self.stdout.write(f'{label}: {verb.lower()} {count}.')
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} строк: {sum(result.values())}.'
+        ))
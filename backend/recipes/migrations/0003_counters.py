@@ -0,0 +1,55 @@
+# Generated by Django 3.2 on 2026-10-17 06:10
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+COUNTERS = (
+    ('Recipe', 'favorites_count', 'Favorites', 'recipe'),
+    ('Recipe', 'in_carts_count', 'ShoppingCart', 'recipe'),
+    ('User', 'recipes_count', 'Recipe', 'author'),
+    ('User', 'subscribers_count', 'Subscriptions', 'author'),
+)
+
+
+def fill_counters(apps, schema_editor):
+    for model, field, source, relation in COUNTERS:
+        source = apps.get_model('recipes', source)
+        apps.get_model('recipes', model).objects.update(**{
+            field: Coalesce(Subquery(
+                source.objects.filter(**{relation: OuterRef('pk')})
+                .order_by().values(relation)
+                .annotate(count=Count('pk')).values('count')
+            ), 0)
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_indexes_and_pub_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество рецептов'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='subscribers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество подписчиков'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
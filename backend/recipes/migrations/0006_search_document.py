@@ -0,0 +1,68 @@
+# Generated by Django 3.2 on 2026-10-17 06:17
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+SEARCH_INDEX = 'recipe_search_idx'
+FTS_TABLE = 'recipes_recipe_fts'
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {SEARCH_INDEX} ON recipes_recipe '
+            "USING gin (to_tsvector('russian'::regconfig, "
+            "COALESCE(search_document, '')))"
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+            "USING fts5(document, tokenize='unicode61 remove_diacritics 2')"
+        )
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeIngredients = apps.get_model('recipes', 'RecipeIngredients')
+    ingredient_names = defaultdict(list)
+    rows = RecipeIngredients.objects.values_list(
+        'recipe_id', 'ingredient__name'
+    )
+    for recipe_id, name in rows.iterator():
+        ingredient_names[recipe_id].append(name)
+    recipes = []
+    for recipe in Recipe.objects.only('name', 'text').iterator():
+        recipe.search_document = '\n'.join(
+            [recipe.name, recipe.text, *ingredient_names[recipe.pk]]
+        ).replace('ё', 'е').replace('Ё', 'Е')
+        recipes.append(recipe)
+    Recipe.objects.bulk_update(recipes, ['search_document'], batch_size=500)
+    if vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, document) VALUES (%s, %s)',
+                [(recipe.pk, recipe.search_document) for recipe in recipes]
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {SEARCH_INDEX}')
+    elif vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_recipe_author_pub_date_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Текст для поиска'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2 on 2026-10-17 07:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_ordering_tiebreak'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_derivatives',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100, verbose_name='Изображение с готовыми уменьшенными копиями'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='avatar_derivatives',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100, verbose_name='Аватарка с готовыми уменьшенными копиями'),
+        ),
+    ]
@@ -1,18 +1,39 @@
-import random
-import string
-
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import IntegrityError, models, transaction
 
 from .constans import (INGREDIENT_MEASUREMENT_UNIT_LENGTH,
                        INGREDIENT_NAME_LENGTH, MAX_VALUE_VALIDATOR,
                        MIN_VALUE_VALIDATOR, RECIPE_LENGTH, SHORT_LINK_LENGTH,
                        TAG_LENGTH, USER_LENGTH)
+from .short_links import encode_short_link, fallback_short_link
 from .validators import validate_username
 
 
-class User(AbstractUser):
+class DerivedFieldsMixin:
+    """Не даёт save() затирать поля, которые меняются только в базе.
+
+    Счётчики и популярность пишутся UPDATE с F() или пакетно в обход
+    save(), и значение в памяти почти всегда устаревшее. Поэтому при
+    сохранении существующей строки без явного update_fields
+    записываются все поля, кроме derived_fields.
+    """
+
+    derived_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (not args and kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')
+                and not self._state.adding and self.pk is not None):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.derived_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class User(DerivedFieldsMixin, AbstractUser):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ('username', 'first_name', 'last_name')
     email = models.EmailField(
@@ -38,6 +59,24 @@ class User(AbstractUser):
         null=True,
         upload_to='avatars/'
     )
+    avatar_derivatives = models.CharField(
+        max_length=100,
+        blank=True,
+        default='',
+        editable=False,
+        verbose_name='Аватарка с готовыми уменьшенными копиями')
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество рецептов')
+    subscribers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписчиков')
+
+    derived_fields = (
+        'recipes_count', 'subscribers_count', 'avatar_derivatives'
+    )
 
     class Meta:
         verbose_name = 'Пользователь'
@@ -64,6 +103,9 @@ class Subscriptions(models.Model):
         constraints = [
             models.UniqueConstraint(
                 fields=['user', 'author'], name='subscriptions_unique')]
+        indexes = [
+            models.Index(
+                fields=['author', 'user'], name='subscriptions_author_idx')]
 
     def __str__(self):
         return f'Подписка {self.user} на {self.author}'
@@ -91,15 +133,69 @@ class Ingredient(models.Model):
         verbose_name='Единица измерения ингредиента')
 
     class Meta:
-        models.UniqueConstraint(
-            fields=['name', 'measurement_unit'], name='unique_ingredient'
-        )
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'], name='unique_ingredient'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['name'],
+                name='ingredient_name_prefix_idx',
+                opclasses=['varchar_pattern_ops']
+            )
+        ]
 
     def __str__(self):
         return f'{self.name} ({self.measurement_unit})'
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+
+    def with_user_flags(self, user):
+        """Подгружает связи и флаги пользователя для выдачи рецептов."""
+        authors = User.objects.all()
+        if user.is_authenticated:
+            authors = authors.annotate(is_subscribed=models.Exists(
+                Subscriptions.objects.filter(
+                    user=user, author=models.OuterRef('pk')
+                )
+            ))
+            queryset = self.annotate(
+                is_favorited=models.Exists(Favorites.objects.filter(
+                    user=user, recipe=models.OuterRef('pk')
+                )),
+                is_in_shopping_cart=models.Exists(
+                    ShoppingCart.objects.filter(
+                        user=user, recipe=models.OuterRef('pk')
+                    )
+                ),
+            )
+        else:
+            authors = authors.annotate(is_subscribed=models.Value(
+                False, output_field=models.BooleanField()
+            ))
+            queryset = self.annotate(
+                is_favorited=models.Value(
+                    False, output_field=models.BooleanField()
+                ),
+                is_in_shopping_cart=models.Value(
+                    False, output_field=models.BooleanField()
+                ),
+            )
+        return queryset.prefetch_related(
+            models.Prefetch('author', queryset=authors),
+            models.Prefetch('tags', queryset=Tag.objects.order_by('id')),
+            models.Prefetch(
+                'ingredient_list',
+                queryset=RecipeIngredients.objects.select_related(
+                    'ingredient'
+                ).order_by('id')
+            ),
+        )
+
+
+class Recipe(DerivedFieldsMixin, models.Model):
     tags = models.ManyToManyField(
         Tag,
         related_name='recipes',
@@ -123,6 +219,12 @@ class Recipe(models.Model):
     image = models.ImageField(
         'Изображение',
         upload_to='recipes/')
+    image_derivatives = models.CharField(
+        max_length=100,
+        blank=True,
+        default='',
+        editable=False,
+        verbose_name='Изображение с готовыми уменьшенными копиями')
     text = models.TextField(
         verbose_name='Описание рецепта')
     cooking_time = models.PositiveSmallIntegerField(
@@ -144,27 +246,65 @@ class Recipe(models.Model):
     )
     pub_date = models.DateTimeField(
         auto_now_add=True,
-        verbose_name='Дата публикации'),
+        verbose_name='Дата публикации')
     short_link = models.CharField(
         max_length=SHORT_LINK_LENGTH,
+        unique=True,
         blank=True,
         null=True
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном')
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В списках покупок')
+    popularity = models.FloatField(
+        default=0,
+        editable=False,
+        verbose_name='Популярность')
+    search_document = models.TextField(
+        blank=True,
+        default='',
+        editable=False,
+        verbose_name='Текст для поиска')
 
-    def generate_short_link(self):
-        while True:
-            short_code = ''.join(
-                random.choice(
-                    string.ascii_letters + string.digits
-                ) for _ in range(6)
-            )
-            if not Recipe.objects.filter(short_link=short_code).exists():
-                return short_code
+    objects = RecipeQuerySet.as_manager()
+
+    derived_fields = (
+        'favorites_count', 'in_carts_count', 'popularity', 'image_derivatives'
+    )
+
+    class Meta:
+        ordering = ('-pub_date', '-id')
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'], name='recipe_pub_date_idx'),
+            models.Index(
+                fields=['author', '-pub_date'],
+                name='recipe_author_pub_date_idx'),
+            models.Index(
+                fields=['-popularity', '-id'], name='recipe_popularity_idx'),
+            models.Index(
+                fields=['cooking_time', 'id'], name='recipe_cooking_time_idx'),
+        ]
 
     def save(self, *args, **kwargs):
-        if not self.short_link:
-            self.short_link = self.generate_short_link()
-        super(Recipe, self).save(*args, **kwargs)
+        super().save(*args, **kwargs)
+        if self.short_link:
+            return
+        short_link = encode_short_link(self.pk)
+        try:
+            with transaction.atomic():
+                Recipe.objects.filter(pk=self.pk).update(
+                    short_link=short_link
+                )
+        except IntegrityError:
+            short_link = fallback_short_link(self.pk)
+            Recipe.objects.filter(pk=self.pk).update(short_link=short_link)
+        self.short_link = short_link
 
     def __str__(self):
         return (
@@ -243,6 +383,10 @@ class RecipeRelation(models.Model):
         on_delete=models.CASCADE,
         verbose_name='Пользователь'
     )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата добавления'
+    )
 
     class Meta:
         abstract = True
@@ -254,6 +398,10 @@ class Favorites(RecipeRelation):
         constraints = [
             models.UniqueConstraint(
                 fields=['recipe', 'user'], name='userfavorites_unique')]
+        indexes = [
+            models.Index(fields=['user', 'recipe'], name='favorites_user_idx'),
+            models.Index(
+                fields=['created_at'], name='favorites_created_at_idx')]
         default_related_name = 'favorites'
 
     def __str__(self):
@@ -266,6 +414,11 @@ class ShoppingCart(RecipeRelation):
         constraints = [
             models.UniqueConstraint(
                 fields=['recipe', 'user'], name='usershoppingcart_unique')]
+        indexes = [
+            models.Index(
+                fields=['user', 'recipe'], name='shoppingcart_user_idx'),
+            models.Index(
+                fields=['created_at'], name='shoppingcart_created_at_idx')]
         default_related_name = 'shopping_cart'
 
     def __str__(self):
@@ -0,0 +1,61 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .constans import (FAVORITE_POPULARITY_WEIGHT,
+                       SHOPPING_CART_POPULARITY_WEIGHT)
+from .models import Favorites, Recipe, ShoppingCart
+
+
+def compute_scores(now=None):
+    """Популярность рецептов с затуханием по времени.
+
+    Каждое добавление в избранное или в корзину за последние
+    POPULARITY_WINDOW_DAYS дней даёт вес источника, который
+    уменьшается вдвое каждые POPULARITY_HALF_LIFE_DAYS дней.
+    Строки группируются по рецепту и дню прямо в базе. Расчёт ведётся
+    на момент now, добавления после него не учитываются.
+    """
+    now = now or timezone.now()
+    today = timezone.localdate(now)
+    since = now - timedelta(days=settings.POPULARITY_WINDOW_DAYS)
+    scores = defaultdict(float)
+    sources = (
+        (Favorites, FAVORITE_POPULARITY_WEIGHT),
+        (ShoppingCart, SHOPPING_CART_POPULARITY_WEIGHT),
+    )
+    for model, weight in sources:
+        rows = model.objects.filter(
+            created_at__range=(since, now)
+        ).annotate(
+            day=TruncDate('created_at')
+        ).order_by().values('recipe_id', 'day').annotate(
+            count=Count('pk')
+        ).values_list('recipe_id', 'day', 'count')
+        for recipe_id, day, count in rows.iterator():
+            age = (today - day).days
+            scores[recipe_id] += weight * count * 0.5 ** (
+                age / settings.POPULARITY_HALF_LIFE_DAYS
+            )
+    return scores
+
+
+def update_popularity(batch_size=1000):
+    """Записывает свежие оценки в Recipe.popularity одной транзакцией."""
+    scores = compute_scores()
+    with transaction.atomic():
+        Recipe.objects.filter(popularity__gt=0).update(popularity=0)
+        Recipe.objects.bulk_update(
+            [
+                Recipe(pk=recipe_id, popularity=round(score, 6))
+                for recipe_id, score in scores.items()
+            ],
+            ['popularity'],
+            batch_size=batch_size
+        )
+    return len(scores)
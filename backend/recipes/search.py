@@ -0,0 +1,98 @@
+import re
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import FloatField, Value
+from django.db.models.expressions import RawSQL
+
+from .models import Recipe, RecipeIngredients
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipe_fts'
+SEARCH_ORDERING = ('-search_rank', '-id')
+
+
+def normalize(text):
+    return text.replace('ё', 'е').replace('Ё', 'Е')
+
+
+def build_search_document(name, text, ingredient_names):
+    return normalize('\n'.join([name, text, *ingredient_names]))
+
+
+def index_recipes(recipe_ids):
+    """Пересобирает поисковый текст рецептов: название, описание
+    и названия ингредиентов. В SQLite обновляет и таблицу FTS5."""
+    ingredient_names = defaultdict(list)
+    rows = RecipeIngredients.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list('recipe_id', 'ingredient__name')
+    for recipe_id, name in rows:
+        ingredient_names[recipe_id].append(name)
+    recipes = list(
+        Recipe.objects.filter(pk__in=recipe_ids).only('name', 'text')
+    )
+    for recipe in recipes:
+        recipe.search_document = build_search_document(
+            recipe.name, recipe.text, ingredient_names[recipe.pk]
+        )
+    Recipe.objects.bulk_update(recipes, ['search_document'])
+    if connection.vendor == 'sqlite':
+        unindex_recipes(recipe_ids)
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, document) VALUES (%s, %s)',
+                [(recipe.pk, recipe.search_document) for recipe in recipes]
+            )
+
+
+def unindex_recipes(recipe_ids):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+            [(recipe_id,) for recipe_id in recipe_ids]
+        )
+
+
+def search_recipes(queryset, value):
+    """Рецепты, подходящие под запрос, с оценкой search_rank.
+
+    Каждое слово запроса ищется как префикс, все слова обязательны.
+    В PostgreSQL работает GIN-индекс по to_tsvector(search_document),
+    в SQLite — таблица FTS5, в остальных базах — простой icontains.
+    """
+    words = re.findall(r'\w+', normalize(value))
+    if not words:
+        return queryset.annotate(
+            search_rank=Value(0, output_field=FloatField())
+        ).none()
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                                    SearchVector)
+        vector = SearchVector('search_document', config=SEARCH_CONFIG)
+        query = SearchQuery(
+            ' & '.join(f'{word}:*' for word in words),
+            config=SEARCH_CONFIG, search_type='raw'
+        )
+        return queryset.annotate(
+            search_vector=vector,
+            search_rank=SearchRank(vector, query),
+        ).filter(search_vector=query)
+    if connection.vendor == 'sqlite':
+        match = ' '.join(f'"{word}"*' for word in words)
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            (match,)
+        )).annotate(search_rank=RawSQL(
+            f'SELECT -bm25({FTS_TABLE}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s '
+            f'AND rowid = {Recipe._meta.db_table}.id',
+            (match,), output_field=FloatField()
+        ))
+    for word in words:
+        queryset = queryset.filter(search_document__icontains=word)
+    return queryset.annotate(
+        search_rank=Value(0, output_field=FloatField())
+    )
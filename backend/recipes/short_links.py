@@ -0,0 +1,73 @@
+import hashlib
+from functools import lru_cache
+
+from django.conf import settings
+
+from .constans import SHORT_CODE_LENGTH, SHORT_LINK_ALPHABET
+
+BASE = len(SHORT_LINK_ALPHABET)
+SPACE = BASE ** SHORT_CODE_LENGTH
+# Раньше коды были случайными строками из шести символов. Новые коды
+# имеют длину SHORT_CODE_LENGTH или не меньше семи символов, поэтому
+# со старыми ссылками они не пересекаются.
+LONG_CODE_OFFSET = BASE ** 6
+
+
+def _to_base62(number, length):
+    digits = []
+    while number or len(digits) < length:
+        number, digit = divmod(number, BASE)
+        digits.append(SHORT_LINK_ALPHABET[digit])
+    return ''.join(reversed(digits))
+
+
+def _from_base62(code):
+    number = 0
+    for char in code:
+        number = number * BASE + SHORT_LINK_ALPHABET.index(char)
+    return number
+
+
+@lru_cache(maxsize=None)
+def _permutation_keys():
+    digest = hashlib.sha256(settings.SHORT_LINK_KEY.encode()).digest()
+    keys = []
+    for start in (0, 16):
+        multiplier = int.from_bytes(digest[start:start + 8], 'big') % SPACE
+        multiplier |= 1
+        while multiplier % 31 == 0:
+            multiplier += 2
+        offset = int.from_bytes(digest[start + 8:start + 16], 'big') % SPACE
+        keys.append((multiplier, offset))
+    return keys
+
+
+def encode_short_link(pk):
+    """Короткий код рецепта по его первичному ключу.
+
+    Ключ дважды переставляется аффинным преобразованием по модулю 62^5
+    с параметрами из SHORT_LINK_KEY, а между раундами разряды кода
+    меняются местами. Это биекция, поэтому коды соседних рецептов
+    не идут подряд, но остаются уникальными без проверки по базе.
+    """
+    if pk >= SPACE:
+        return fallback_short_link(pk)
+    number = pk
+    for round_number, (multiplier, offset) in enumerate(_permutation_keys()):
+        if round_number:
+            number = _from_base62(
+                _to_base62(number, SHORT_CODE_LENGTH)[::-1]
+            )
+        number = (number * multiplier + offset) % SPACE
+    return _to_base62(number, SHORT_CODE_LENGTH)
+
+
+def fallback_short_link(pk):
+    """Код на случай, если encode_short_link(pk) уже занят.
+
+    Такое бывает после смены SHORT_LINK_KEY: перестановка меняется,
+    и новый код может совпасть с кодом, выданным со старым ключом.
+    Запасной код — pk без перестановки, он длиннее SHORT_CODE_LENGTH
+    и старых шести символов, поэтому занят быть не может.
+    """
+    return _to_base62(pk + LONG_CODE_OFFSET, 0)
@@ -0,0 +1,86 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from .constans import AVATAR_IMAGE_SIZES, RECIPE_IMAGE_SIZES
+from .counters import COUNTERS, change_counter
+from .images import derivative_name, enqueue, mark_ready
+from .models import Ingredient, Recipe, RecipeIngredients, User
+from .search import index_recipes, unindex_recipes
+
+# Отправляется после коммита массовой загрузки справочника: bulk_create
+# не вызывает post_save. sender — модель справочника.
+bulk_loaded = Signal()
+
+
+def schedule_derivatives(file, sizes):
+    if not file:
+        return
+    name = file.name
+    if getattr(file.instance, f'{file.field.name}_derivatives') == name:
+        return
+    if file.storage.exists(derivative_name(name, sizes[0])):
+        transaction.on_commit(lambda: mark_ready(name))
+    else:
+        transaction.on_commit(lambda: enqueue(name, sizes))
+
+
+@receiver(post_save, sender=Recipe)
+def process_recipe_image(instance, **kwargs):
+    schedule_derivatives(instance.image, RECIPE_IMAGE_SIZES)
+
+
+@receiver(post_save, sender=User)
+def process_avatar(instance, **kwargs):
+    schedule_derivatives(instance.avatar, AVATAR_IMAGE_SIZES)
+
+
+@receiver(post_save, sender=Recipe)
+def index_recipe(instance, raw=False, **kwargs):
+    # Ингредиенты пишутся после сохранения рецепта в той же транзакции,
+    # поэтому индексируем после коммита.
+    if not raw:
+        recipe_ids = [instance.pk]
+        transaction.on_commit(lambda: index_recipes(recipe_ids))
+
+
+@receiver(post_delete, sender=Recipe)
+def unindex_recipe(instance, **kwargs):
+    recipe_ids = [instance.pk]
+    transaction.on_commit(lambda: unindex_recipes(recipe_ids))
+
+
+@receiver(post_save, sender=Ingredient)
+def reindex_ingredient_recipes(instance, created, raw=False, **kwargs):
+    if created or raw:
+        return
+    recipe_ids = list(RecipeIngredients.objects.filter(
+        ingredient=instance
+    ).values_list('recipe_id', flat=True))
+    if recipe_ids:
+        transaction.on_commit(lambda: index_recipes(recipe_ids))
+
+
+def connect_counter(model, field, source, relation):
+    attname = source._meta.get_field(relation).attname
+
+    def created(instance, created, raw=False, **kwargs):
+        pk = getattr(instance, attname)
+        if created and not raw and pk is not None:
+            change_counter(model, pk, field, 1)
+
+    def deleted(instance, **kwargs):
+        pk = getattr(instance, attname)
+        if pk is not None:
+            change_counter(model, pk, field, -1)
+
+    post_save.connect(
+        created, sender=source, weak=False, dispatch_uid=f'{field}_created'
+    )
+    post_delete.connect(
+        deleted, sender=source, weak=False, dispatch_uid=f'{field}_deleted'
+    )
+
+
+for counter in COUNTERS:
+    connect_counter(*counter)